@@ -1,15 +1,39 @@
 from pathlib import Path
-import pandas as pd
 import argparse
 import yaml
 import json
 
 from modules.data_filtering import apply_filters
-from modules.report_generator import generate_report_html
-from modules.populate_variables import find_and_replace
+from modules.bitmap_index import build_indexes
+from modules.linelist_loader import DEFAULT_CHUNKSIZE, load_linelist, iter_linelist
+from modules.column_planner import (
+    aggregate_columns,
+    filter_columns,
+    report_columns,
+    populate_columns,
+    report_texts,
+    template_variables,
+)
+from modules.placeholder_scanner import iter_segments, placeholders_text, read_chunks
+from modules.populate_variables import (
+    summarise_filtered_chunks,
+    template_dimensions,
+    template_values,
+    populate_file,
+)
 
 
 def create_report(args):
+    # imported here so that other subcommands do not load the report generator
+    from modules.report_generator import write_report_html, aggregate_sections
+    from modules.report_state import (
+        RECORD_ID_COLUMN,
+        load_state,
+        save_state,
+        state_key,
+        update_state,
+    )
+
     print(
         "Creating an HTML report from the linelist file, this should just take a few seconds..."
     )
@@ -18,29 +42,125 @@ def create_report(args):
     with open(args.config, "r") as f:
         config = yaml.safe_load(f)
 
-    # load linelist
-    linelist = pd.read_csv(args.linelist)
-
     # load global filtering config
     filtering_config = config.get("filtering", [])
-    # apply filters
-    filtered_linelist = apply_filters(linelist, filtering_config)
-
     # load report config
     reporting_config = config.get("reporting", {})
-    # generate report HTML
-    report_html = generate_report_html(
-        filtered_linelist, reporting_config, args.in_dir, args.out_dir
-    )
+    # get global parameters
+    global_vars = config.get("parameters", {})
+
+    # columns used by the report (and by the variables in the report texts, if
+    # they are to be populated)
+    columns = report_columns(config)
+    if args.populate_vars:
+        report_text = " ".join(report_texts(reporting_config))
+        columns |= populate_columns(config, report_text)
+        variable_names = template_variables(report_text, global_vars)
+        dimensions = template_dimensions(report_text, global_vars)
+    else:
+        variable_names, dimensions = None, None
+
+    # plot sections are cached alongside the report state (unless cached elsewhere),
+    # so that only the sections affected by new or updated records are plotted again
+    section_cache_dir = args.section_cache_dir
+    if args.state and section_cache_dir is None:
+        section_cache_dir = f"{args.state}.sections"
+
+    if args.state:
+        # fold only the records of the linelist that are new or were updated since the
+        # last run into the aggregates kept in the report state
+        columns |= {RECORD_ID_COLUMN}
+        state = load_state(
+            args.state, state_key(config, columns, variable_names, dimensions)
+        )
+        linelist_chunks = iter_linelist(
+            args.linelist,
+            config.get("linelist_schema"),
+            args.cache_dir,
+            columns,
+            args.chunksize or DEFAULT_CHUNKSIZE,
+        )
+        filtered_linelist = None
+        sections_counts, variables_data, records_count = update_state(
+            state,
+            linelist_chunks,
+            reporting_config.get("sections", []),
+            filtering_config,
+            variable_names,
+            dimensions,
+        )
+        save_state(state, args.state)
+        print(f"{records_count} new or updated records folded into '{args.state}'.")
+    elif args.chunksize:
+        # read linelist in chunks (only the columns used by the report), and keep
+        # only the counts aggregated for each section (with filters applied), and
+        # the summary needed to compute the variables in the report texts (if any)
+        linelist_chunks = iter_linelist(
+            args.linelist,
+            config.get("linelist_schema"),
+            args.cache_dir,
+            columns,
+            args.chunksize,
+        )
+        filtered_linelist = None
+        sections_counts, variables_data = aggregate_sections(
+            linelist_chunks,
+            reporting_config.get("sections", []),
+            filtering_config,
+            variable_names,
+            dimensions,
+        )
+    else:
+        # load linelist (only the columns used by the report)
+        linelist = load_linelist(
+            args.linelist,
+            config.get("linelist_schema"),
+            args.cache_dir,
+            columns,
+        )
+        # apply filters (keeping only the columns used by the sections and variables)
+        filtered_linelist = apply_filters(
+            linelist,
+            filtering_config,
+            aggregate_columns(
+                reporting_config.get("sections", []), variable_names, dimensions
+            ),
+        )
+        # build bitmap indexes used by section filters (if any)
+        build_indexes(filtered_linelist, config.get("indexes"))
+        sections_counts = None
+        variables_data = filtered_linelist if args.populate_vars else None
 
-    # write report to an HTML file
+    # generate report HTML (populating variables in the report texts, if requested,
+    # from the filtered linelist already in memory), streamed to an HTML file
     output_file = Path(args.out_dir) / "report.html"
-    with open(output_file, "w", encoding="utf-8") as f:
-        f.write(report_html)
+    write_report_html(
+        output_file,
+        filtered_linelist,
+        reporting_config,
+        args.in_dir,
+        args.out_dir,
+        sections_counts,
+        variables_data,
+        global_vars,
+        args.workers,
+        section_cache_dir,
+    )
 
     print(f"Report generated and saved to '{output_file}'. Exiting...")
 
 
+def output_file_path(out_dir, in_file, name=None):
+    # path of a populated HTML file, not overwriting any existing file
+    stem = Path(in_file).stem if name is None else f"{Path(in_file).stem}.{name}"
+    output_file = Path(out_dir) / f"{stem}.populated.html"
+    filename_counter = 1
+    while output_file.exists():
+        output_file = Path(out_dir) / f"{stem}.populated.{filename_counter}.html"
+        filename_counter += 1
+    return output_file
+
+
 def populate_variables(args):
     print(
         "Finding and replacing variables in the HTML file, this should just take a few seconds..."
@@ -50,34 +170,92 @@ def populate_variables(args):
     with open(args.config, "r") as f:
         config = yaml.safe_load(f)
 
-    # load linelist
-    linelist = pd.read_csv(args.linelist)
-
     # get global parameters
     global_vars = config.get("parameters", {})
 
-    # load HTML file
-    with open(args.in_file, "r", encoding="utf-8") as f:
-        html = f.read()
+    # load batch, i.e. one entry per HTML file to populate, each with its own linelist
+    # (defaults to --linelist), filtering and parameters (if any)
+    if args.batch:
+        with open(args.batch, "r") as f:
+            batch = yaml.safe_load(f) or []
+    else:
+        batch = [{}]
+    for entry in batch:
+        entry.setdefault("linelist", args.linelist)
 
-    # find and replace variables
-    populated_html, replacements_count = find_and_replace(html, linelist, global_vars)
+    if len(batch) > 1:
+        # compile HTML file once into text and placeholders, shared by the whole batch
+        segments = list(iter_segments(read_chunks(args.in_file)))
+        html = " ".join(match.group(0) for _, match in segments if match is not None)
+    else:
+        # scan HTML file for placeholders (streamed, only the placeholders are kept)
+        segments = None
+        html = placeholders_text(read_chunks(args.in_file))
 
-    # write populated HTML to a new file
-    output_file = Path(args.out_dir) / f"{Path(args.in_file).stem}.populated.html"
-    filename_counter = 1
-    while output_file.exists():
-        output_file = (
-            Path(args.out_dir)
-            / f"{Path(args.in_file).stem}.populated.{filename_counter}.html"
-        )
-        filename_counter += 1
-    with open(output_file, "w", encoding="utf-8") as f:
-        f.write(populated_html)
+    # load (or read) each linelist once for all the entries using it
+    for linelist_file in dict.fromkeys(entry["linelist"] for entry in batch):
+        entries = [entry for entry in batch if entry["linelist"] == linelist_file]
+        filtering_configs = [entry.get("filtering") for entry in entries]
+        # columns used by the placeholders in the HTML file and by the filters
+        variables_columns = populate_columns(config, html)
+        columns = set(variables_columns)
+        for filtering_config in filtering_configs:
+            columns |= filter_columns(filtering_config)
 
-    print(
-        f"{replacements_count} variables replaced and HTML file saved to '{output_file}'. Exiting..."
-    )
+        if args.chunksize:
+            # read linelist in chunks, and keep only the summary needed to compute the
+            # variables (including the count cube needed by parameterized variables)
+            # for each entry
+            linelists = summarise_filtered_chunks(
+                iter_linelist(
+                    linelist_file,
+                    config.get("linelist_schema"),
+                    args.cache_dir,
+                    columns,
+                    args.chunksize,
+                ),
+                filtering_configs,
+                dimensions=template_dimensions(html, global_vars),
+            )
+        else:
+            # load linelist
+            linelist = load_linelist(
+                linelist_file,
+                config.get("linelist_schema"),
+                args.cache_dir,
+                columns,
+            )
+            # build bitmap indexes used to count values and filter (if any)
+            build_indexes(linelist, config.get("indexes"))
+            # apply filters of each entry (if any)
+            linelists = [
+                apply_filters(linelist, filtering_config, variables_columns)
+                for filtering_config in filtering_configs
+            ]
+
+        for entry, linelist in zip(entries, linelists):
+            extra_vars = {**global_vars, **(entry.get("parameters") or {})}
+
+            # compute variables used in the HTML file
+            values = template_values(html, linelist, extra_vars)
+
+            # find and replace variables, streaming the populated HTML to a new file
+            output_file = output_file_path(
+                args.out_dir, args.in_file, entry.get("name")
+            )
+            report = populate_file(
+                args.in_file, output_file, values, extra_vars, segments
+            )
+
+            for placeholder, line, column in report["unresolved"]:
+                print(
+                    f"Unresolved placeholder {placeholder} (line {line}, column {column})"
+                )
+            print(
+                f"{report['replacements_count']} variables replaced and HTML file saved to '{output_file}'."
+            )
+
+    print("Exiting...")
 
 
 def list_variables(args):
@@ -117,10 +295,32 @@ def cli(raw_args=None):
         help="Path to the input directory (for storing any resources needed by the report, e.g., shapefiles).",
     )
     parser_create.add_argument("--out_dir", help="Path to the output directory.")
+    parser_create.add_argument(
+        "--cache_dir",
+        help="Path to a directory for caching the parsed linelist in a columnar format (requires pyarrow). Subsequent runs on the same unchanged linelist file reuse the cache.",
+    )
+    parser_create.add_argument(
+        "--chunksize",
+        type=int,
+        help="Read the linelist in chunks of this many rows and keep only aggregated counts in memory, for linelists larger than the available memory.",
+    )
     parser_create.add_argument(
         "--populate_vars",
         action="store_true",
-        help="Populate variables in the HTML file before generating the report.",
+        help="Populate variables in the report title, introductory text and text sections (from the filtered linelist and the parameters of the configuration file) when generating the report.",
+    )
+    parser_create.add_argument(
+        "--workers",
+        type=int,
+        help="Number of worker processes plotting the plot sections of the report in parallel (default: plot sections one at a time).",
+    )
+    parser_create.add_argument(
+        "--section_cache_dir",
+        help="Path to a directory for caching the HTML (and exported files) of each plot section. Subsequent runs reuse the sections whose config, data and referenced files are unchanged.",
+    )
+    parser_create.add_argument(
+        "--state",
+        help="Path to a file keeping the counts aggregated for the report and the records they were aggregated from. Subsequent runs only fold in the records of the linelist (a full export or only the latest records) that are new or were updated, and only plot again the sections they affect.",
     )
     parser_create.set_defaults(func=create_report)
 
@@ -138,6 +338,19 @@ def cli(raw_args=None):
         help="Path to the input html file, where the variables will be populated.",
     )
     parser_populate.add_argument("--out_dir", help="Path to the output directory.")
+    parser_populate.add_argument(
+        "--cache_dir",
+        help="Path to a directory for caching the parsed linelist in a columnar format (requires pyarrow). Subsequent runs on the same unchanged linelist file reuse the cache.",
+    )
+    parser_populate.add_argument(
+        "--chunksize",
+        type=int,
+        help="Read the linelist in chunks of this many rows and keep only aggregated counts in memory, for linelists larger than the available memory.",
+    )
+    parser_populate.add_argument(
+        "--batch",
+        help="Path to a YAML file listing the HTML files to populate from the same input HTML file, each with an optional name, linelist (defaults to --linelist), filtering and parameters. The input HTML file is compiled once and each linelist is loaded once for the whole batch.",
+    )
     parser_populate.set_defaults(func=populate_variables)
 
     # list variables
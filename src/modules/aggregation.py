@@ -0,0 +1,66 @@
+import pandas as pd
+
+# column of a count cube holding the number of linelist rows behind each of its rows
+COUNT_COLUMN = "__count__"
+
+
+def build_cube(data, columns):
+    """
+    Builds a sparse count cube from a linelist, i.e. one row per observed combination
+    of values of the given columns (missing values included) with the number of rows of
+    the linelist in COUNT_COLUMN. The cube keeps the columns (and dtypes) of the
+    linelist, so that filters and aggregations over these columns can be applied to
+    the cube instead of the linelist, counting rows with count_rows.
+    """
+    columns = sorted(column for column in columns if column in data.columns)
+    return (
+        data.groupby(columns, observed=True, dropna=False, sort=False)
+        .size()
+        .rename(COUNT_COLUMN)
+        .reset_index()
+    )
+
+
+def count_rows(data, keys):
+    """
+    Counts the rows of a linelist, or of the linelist behind a count cube (see
+    build_cube), for each observed combination of values of the keys.
+    """
+    if COUNT_COLUMN in data.columns:
+        return data.groupby(keys, observed=True)[COUNT_COLUMN].sum().rename(None)
+    return data.groupby(keys, observed=True).size()
+
+
+def combine_counts(counts, other):
+    """
+    Combines two partial counts (pd.Series of counts indexed by one or more keys),
+    e.g. computed on different chunks of a linelist, by summing the counts of
+    matching keys. Either counts may be None (nothing counted yet).
+    """
+    if counts is None or counts.empty:
+        return other
+    if other is None or other.empty:
+        return counts
+
+    # concatenate and sum counts sharing the same key
+    return (
+        pd.concat([counts, other])
+        .groupby(
+            level=list(range(counts.index.nlevels)),
+            observed=True,
+            dropna=False,
+            sort=False,
+        )
+        .sum()
+    )
+
+
+def subtract_counts(counts, other):
+    """
+    Subtracts partial counts (e.g. of rows removed from a linelist) from counts, see
+    combine_counts, dropping the keys left with no rows. Either counts may be None.
+    """
+    if other is None or other.empty:
+        return counts
+    counts = combine_counts(counts, -other)
+    return counts[counts != 0]
@@ -0,0 +1,179 @@
+import numpy as np
+import pandas as pd
+
+from modules.data_filtering import frame_cache
+
+# columns with more distinct values than this are not indexed (except with sorted indexes)
+MAX_CARDINALITY = 1000
+
+# number of set bits in each possible byte (for numpy < 2.0, without np.bitwise_count)
+_POPCOUNTS = np.array([bin(byte).count("1") for byte in range(256)], dtype=np.uint8)
+
+
+def popcount(bitset):
+    """
+    Returns the number of set bits in a packed bitset (see np.packbits).
+    """
+    if hasattr(np, "bitwise_count"):
+        return int(np.bitwise_count(bitset).sum(dtype=np.int64))
+    return int(_POPCOUNTS[bitset].sum(dtype=np.int64))
+
+
+class BitmapIndex:
+    """
+    Bitmap index over a low-cardinality column, holding one packed bitset per distinct
+    value (rows with missing values are in none of them), so that include/exclude
+    filters and value counts reduce to AND/OR operations and popcounts on bitsets.
+    """
+
+    def __init__(self, codes, values):
+        self.length = len(codes)
+        self.all = np.packbits(np.ones(self.length, dtype=bool))
+        self.none = np.zeros_like(self.all)
+        self.bitsets = {
+            value: np.packbits(codes == code) for code, value in enumerate(values)
+        }
+
+    def bitset(self, values):
+        """
+        Returns the bitset of rows holding any of the given values.
+        """
+        bitset = self.none
+        for value in values:
+            if value in self.bitsets:
+                bitset = bitset | self.bitsets[value]
+        return bitset
+
+    def complement(self, bitset):
+        """
+        Returns the complement of a bitset (ignoring the padding bits).
+        """
+        return ~bitset & self.all
+
+    def filter_bitmap(self, filter_item):
+        """
+        Evaluates a filter matching values (take_only, include, exclude) as a bitmap,
+        or returns None if the filter cannot be evaluated from the index.
+        """
+        if filter_item["min"] is not None or filter_item["max"] is not None:
+            return None
+        values = (
+            [filter_item["take_only"]] if filter_item["take_only"] is not None else []
+        )
+        values += (filter_item["include"] or []) + (filter_item["exclude"] or [])
+        # missing values are not indexed
+        if any(pd.isna(value) for value in values):
+            return None
+
+        bitmap = self.all
+        if filter_item["take_only"] is not None:
+            bitmap = bitmap & self.bitset([filter_item["take_only"]])
+        if filter_item["include"] is not None:
+            bitmap = bitmap & self.bitset(filter_item["include"])
+        if filter_item["exclude"] is not None:
+            bitmap = bitmap & self.complement(self.bitset(filter_item["exclude"]))
+        return bitmap
+
+    def count(self, value):
+        """
+        Returns the number of rows holding a value.
+        """
+        return popcount(self.bitsets.get(value, self.none))
+
+    def value_counts(self):
+        """
+        Returns the number of rows holding each value, including missing values,
+        like pd.Series.value_counts(dropna=False).
+        """
+        value_counts = {
+            value: popcount(bitset) for value, bitset in self.bitsets.items()
+        }
+        missing_count = self.length - sum(value_counts.values())
+        if missing_count > 0:
+            value_counts[np.nan] = missing_count
+        return pd.Series(value_counts, dtype="int64")
+
+
+class SortedIndex:
+    """
+    Sorted index over a date (or numeric) column, holding the permutation of its rows
+    that sorts them by value (rows with missing values left out), so that min/max
+    filters reduce to binary searches for the contiguous slice of rows in range.
+    """
+
+    def __init__(self, column_data):
+        self.length = len(column_data)
+        rows = np.flatnonzero(column_data.notna().to_numpy())
+        self.order = rows[np.argsort(column_data.iloc[rows].to_numpy(), kind="stable")]
+        self.values = pd.Index(column_data.iloc[self.order])
+
+    def rows_bitmap(self, rows):
+        """
+        Returns the bitmap of the given rows.
+        """
+        mask = np.zeros(self.length, dtype=bool)
+        mask[rows] = True
+        return np.packbits(mask)
+
+    def filter_bitmap(self, filter_item):
+        """
+        Evaluates a filter on a range of values (min, max) as a bitmap, or returns None
+        if the filter cannot be evaluated from the index.
+        """
+        if (
+            filter_item["take_only"] is not None
+            or filter_item["include"] is not None
+            or filter_item["exclude"] is not None
+            or (filter_item["min"] is None and filter_item["max"] is None)
+        ):
+            return None
+
+        # bounds are inclusive
+        start, stop = 0, len(self.values)
+        if filter_item["min"] is not None:
+            start = self.values.searchsorted(filter_item["min"], side="left")
+        if filter_item["max"] is not None:
+            stop = self.values.searchsorted(filter_item["max"], side="right")
+        return self.rows_bitmap(self.order[start:stop])
+
+    def value_counts(self):
+        """
+        Returns the number of rows holding each value, including missing values,
+        like pd.Series.value_counts(dropna=False) (but sorted by value).
+        """
+        # rows holding the same value are contiguous in the sorted index
+        starts = np.flatnonzero(
+            np.r_[True, self.values[1:] != self.values[:-1]][: len(self.values)]
+        )
+        counts = np.diff(np.r_[starts, len(self.values)])
+        index = self.values[starts]
+        missing_count = self.length - len(self.values)
+        if missing_count > 0:
+            index = index.insert(len(index), None)
+            counts = np.r_[counts, missing_count]
+        return pd.Series(counts, index=index, dtype="int64")
+
+
+def build_indexes(data_df, columns):
+    """
+    Builds indexes on the given columns of a dataframe, which are then used by filters
+    and variable counts evaluated on this dataframe: sorted indexes on date and numeric
+    columns, and bitmap indexes on other (low-cardinality) columns. Columns that are
+    missing, or have more than MAX_CARDINALITY distinct values for a bitmap index,
+    are skipped.
+    """
+    indexes = frame_cache(data_df, "indexes")
+    for column in columns or []:
+        if column not in data_df.columns or column in indexes:
+            continue
+        dtype = data_df[column].dtype
+        if pd.api.types.is_datetime64_any_dtype(dtype) or (
+            pd.api.types.is_numeric_dtype(dtype)
+            and not pd.api.types.is_bool_dtype(dtype)
+        ):
+            indexes[column] = SortedIndex(data_df[column])
+            continue
+        codes, values = pd.factorize(data_df[column])
+        if len(values) <= MAX_CARDINALITY:
+            indexes[column] = BitmapIndex(codes, values)
+    return indexes
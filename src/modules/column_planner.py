@@ -0,0 +1,124 @@
+from modules.plot_registry import PLOT_TYPES
+from modules.populate_variables import (
+    VARIABLES,
+    template_placeholders,
+    template_dimensions,
+)
+
+
+def filter_columns(filtering_config):
+    """
+    Returns the columns referenced by a filtering config.
+    """
+    # filtering config may be null or malformed, in which case no filter is applied
+    if not isinstance(filtering_config, list):
+        return set()
+    return {
+        filter_item["column"]
+        for filter_item in filtering_config
+        if filter_item.get("column") is not None
+    }
+
+
+def section_columns(section):
+    """
+    Returns the linelist columns referenced by a single report section.
+    """
+    section_type = section.get("type")
+    columns = filter_columns(section.get("filtering"))
+
+    if section_type == "time-series-barplot":
+        columns.add(section.get("time_column"))
+        columns.add(section.get("group_by"))
+        group_by_age_config = section.get("group_by_age") or {}
+        if group_by_age_config.get("active", False):
+            columns.add(group_by_age_config.get("age_column", "age"))
+    elif section_type == "age-sex-pyramid":
+        columns.add(section.get("age_column", "age"))
+        columns.add(section.get("sex_column", "sex"))
+        columns.add(section.get("group_by"))
+    elif section_type == "spatial-map":
+        columns.add(section.get("loc_column"))
+        aggregation_config = section.get("aggregation") or {}
+        if aggregation_config.get("by_epiweek", False) or aggregation_config.get(
+            "period"
+        ):
+            columns.add(aggregation_config.get("time_column"))
+    elif section_type in PLOT_TYPES and "columns" in PLOT_TYPES[section_type]:
+        # plot types registered by other packages (see modules.plot_registry)
+        columns |= set(PLOT_TYPES[section_type]["columns"](section))
+
+    columns.discard(None)
+    return columns
+
+
+def variable_columns(variable_names):
+    """
+    Returns the linelist columns needed to compute the given variables.
+    """
+    columns = set()
+    for variable_name in variable_names:
+        if variable_name in VARIABLES:
+            columns.update(VARIABLES[variable_name]["columns"])
+    return columns
+
+
+def aggregate_columns(sections, variable_names=None, dimensions=None):
+    """
+    Returns the linelist columns the plot sections of a report are aggregated from
+    and, if variable_names is given, the columns needed to summarise the variables
+    over the given dimensions, i.e. the columns used once global filters are applied.
+    """
+    columns = variable_columns(variable_names) if variable_names is not None else set()
+    columns |= set(dimensions or ())
+    for section in sections:
+        if section["type"] in PLOT_TYPES:
+            columns |= section_columns(section)
+    return columns
+
+
+def template_variables(html, extra_vars={}):
+    """
+    Returns the names of the computable variables referenced by placeholders in
+    an HTML string (variables provided by extra_vars are not computed).
+    """
+    variable_names, placeholders = template_placeholders(html, extra_vars)
+    return variable_names | {variable_name for variable_name, _, _ in placeholders}
+
+
+def report_texts(reporting_config):
+    """
+    Returns the texts of a report that may hold variable placeholders, i.e. its title,
+    introductory text and the content of its text and bullet-points sections.
+    """
+    texts = [
+        reporting_config.get("report_title") or "",
+        reporting_config.get("introductory_text") or "",
+    ]
+    for section in reporting_config.get("sections", []):
+        if section.get("type") == "text":
+            texts.append(section.get("content") or "")
+        elif section.get("type") == "bullet-points":
+            texts.extend(section.get("content") or [])
+    return [str(text) for text in texts]
+
+
+def report_columns(config):
+    """
+    Returns the linelist columns needed to create a report from a config, that is
+    the columns used by global filters and by every section of the report.
+    """
+    columns = filter_columns(config.get("filtering"))
+    for section in config.get("reporting", {}).get("sections", []):
+        columns |= section_columns(section)
+    return columns
+
+
+def populate_columns(config, html):
+    """
+    Returns the linelist columns needed to populate the placeholders of an HTML string,
+    including the columns referenced by the parameters of parameterized placeholders.
+    """
+    extra_vars = config.get("parameters", {})
+    variable_names = template_variables(html, extra_vars)
+    return variable_columns(variable_names) | template_dimensions(html, extra_vars)
@@ -1,67 +1,250 @@
+import json
+import weakref
+import hashlib
+import numpy as np
 import pandas as pd
+from functools import lru_cache
+from pandas.api import types as pd_types
 
+# checks for whether a column already has the dtype expected by each filter type
+FILTER_TYPES = {
+    "int": pd_types.is_integer_dtype,
+    "float": pd_types.is_float_dtype,
+    "bool": pd_types.is_bool_dtype,
+    "str": lambda dtype: isinstance(dtype, (pd.CategoricalDtype, pd.StringDtype)),
+    "date": pd_types.is_datetime64_any_dtype,
+}
 
-def apply_filters(data_df, config):
-    # create a mask to filter the data
-    mask = pd.Series(True, index=data_df.index)  # Start with all True values
+# columns cast, masks evaluated and indexes built for filtering, cached per dataframe
+# (by id, for as long as the dataframe is alive)
+_FRAME_CACHE = {}
 
-    # if config is not a list, return the original dataframe
-    if not isinstance(config, list):
-        return data_df
 
-    for filter_item in config:
-        filter_type = filter_item.get("type", None)
-        column = filter_item.get("column", None)
-
-        # skip if essential information is missing
-        if column is None or filter_type is None:
-            continue
-        if column not in data_df.columns:
-            continue
-
-        # cast the column to the specified type
-        if filter_type == "int":
-            data_df[column] = pd.to_numeric(data_df[column], errors="coerce").astype(
-                "Int64"
-            )
-        elif filter_type == "float":
-            data_df[column] = pd.to_numeric(data_df[column], errors="coerce")
-        elif filter_type == "bool":
-            data_df[column] = data_df[column].astype(bool)
-        elif filter_type == "str":
-            data_df[column] = data_df[column].astype(str)
-        elif filter_type == "date":
-            data_df[column] = pd.to_datetime(data_df[column], errors="coerce")
-        else:
-            continue  # unknown type, skip this filter
-
-        # retrieve filter parameters
-        min_ = filter_item.get("min", None)
-        max_ = filter_item.get("max", None)
-        take_only = filter_item.get("take_only", None)
-        include = filter_item.get("include", None)
-        exclude = filter_item.get("exclude", None)
+def cast_column(column_data, filter_type):
+    # cast a column to the type expected by a filter
+    if filter_type == "int":
+        return pd.to_numeric(column_data, errors="coerce").astype("Int64")
+    elif filter_type == "float":
+        return pd.to_numeric(column_data, errors="coerce")
+    elif filter_type == "bool":
+        return column_data.astype(bool)
+    elif filter_type == "str":
+        return column_data.astype(str)
+    elif filter_type == "date":
+        return pd.to_datetime(column_data, errors="coerce")
+    return column_data
 
-        # apply min and max for numeric types and dates
-        if filter_type in ["int", "float", "date"]:
-            if min_ is not None:
-                if filter_type == "date":
-                    min_ = pd.to_datetime(min_)
-                mask &= data_df[column] >= min_
-            if max_ is not None:
-                if filter_type == "date":
-                    max_ = pd.to_datetime(max_)
-                mask &= data_df[column] <= max_
 
-        # apply take_only for boolean type
-        if filter_type == "bool" and take_only is not None:
-            mask &= data_df[column] == take_only
+def frame_cache(data_df, name):
+    """
+    Returns a named cache (dict) attached to a dataframe, which is dropped once the
+    dataframe is garbage collected.
+    """
+    key = id(data_df)
+    if key not in _FRAME_CACHE:
+        _FRAME_CACHE[key] = {}
+        weakref.finalize(data_df, _FRAME_CACHE.pop, key, None)
+    return _FRAME_CACHE[key].setdefault(name, {})
+
+
+def filter_key(filter_item):
+    """
+    Returns a hash of a (compiled) filter, normalized such that equivalent filters,
+    e.g. with include/exclude values listed in a different order, share the same key.
+    """
+    normalized_item = dict(filter_item)
+    for name in ["include", "exclude"]:
+        if normalized_item[name] is not None:
+            normalized_item[name] = sorted(normalized_item[name], key=str)
+    return hashlib.sha1(
+        json.dumps(normalized_item, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+def cached_cast(data_df, column, filter_type):
+    """
+    Returns a column of a dataframe cast to the type expected by a filter, without
+    modifying the dataframe. Casts are done once per column and cached for as long
+    as the dataframe is alive (dataframes are not expected to be modified in between).
+    """
+    column_data = data_df[column]
+    # no cast needed if the column was already typed at load time
+    if FILTER_TYPES[filter_type](column_data.dtype):
+        return column_data
+
+    casts = frame_cache(data_df, "casts")
+    if (column, filter_type) not in casts:
+        casts[(column, filter_type)] = cast_column(column_data, filter_type)
+    return casts[(column, filter_type)]
+
+
+def as_mask(condition):
+    # convert a (possibly nullable) boolean series to a numpy mask, missing values being False
+    return condition.to_numpy(dtype=bool, na_value=False)
+
+
+class FilterPlan:
+    """
+    A filtering config compiled once into a list of filters, where filters that are
+    missing information or have an unknown type are dropped and bounds are parsed,
+    so that evaluating it on a dataframe only involves vectorized comparisons.
+    The mask of each filter is memoized per dataframe as a packed bitmap, so that
+    filters shared by different plans (e.g. sections) are evaluated only once.
+    """
+
+    def __init__(self, config):
+        self.filters = []
+        self.key = ""
+
+        # if config is not a list, no filter is applied
+        if not isinstance(config, list):
+            return
+
+        for filter_item in config:
+            filter_type = filter_item.get("type", None)
+            column = filter_item.get("column", None)
+
+            # skip if essential information is missing or type is unknown
+            if column is None or filter_type not in FILTER_TYPES:
+                continue
+
+            # retrieve filter parameters
+            min_ = filter_item.get("min", None)
+            max_ = filter_item.get("max", None)
+            take_only = filter_item.get("take_only", None)
+            include = filter_item.get("include", None)
+            exclude = filter_item.get("exclude", None)
+
+            # min and max only apply to numeric types and dates
+            if filter_type not in ["int", "float", "date"]:
+                min_, max_ = None, None
+            elif filter_type == "date":
+                min_ = pd.to_datetime(min_) if min_ is not None else None
+                max_ = pd.to_datetime(max_) if max_ is not None else None
+            # take_only only applies to boolean type
+            if filter_type != "bool":
+                take_only = None
 
+            filter_item = {
+                "type": filter_type,
+                "column": column,
+                "min": min_,
+                "max": max_,
+                "take_only": take_only,
+                "include": include,
+                "exclude": exclude,
+            }
+            filter_item["key"] = filter_key(filter_item)
+            self.filters.append(filter_item)
+
+        # key of the whole plan, i.e. of the combination of its filters
+        self.key = "+".join(
+            sorted({filter_item["key"] for filter_item in self.filters})
+        )
+
+    def filter_mask(self, data_df, filter_item):
+        """
+        Evaluates a single filter on a dataframe as a boolean numpy mask.
+        """
+        column_data = cached_cast(data_df, filter_item["column"], filter_item["type"])
+
+        mask = np.ones(len(data_df), dtype=bool)
+        # apply min and max for numeric types and dates
+        if filter_item["min"] is not None:
+            mask &= as_mask(column_data >= filter_item["min"])
+        if filter_item["max"] is not None:
+            mask &= as_mask(column_data <= filter_item["max"])
+        # apply take_only for boolean type
+        if filter_item["take_only"] is not None:
+            mask &= as_mask(column_data == filter_item["take_only"])
         # apply include and exclude for any type
-        if include is not None:
-            mask &= data_df[column].isin(include)
-        if exclude is not None:
-            mask &= ~data_df[column].isin(exclude)
+        if filter_item["include"] is not None:
+            mask &= as_mask(column_data.isin(filter_item["include"]))
+        if filter_item["exclude"] is not None:
+            mask &= ~as_mask(column_data.isin(filter_item["exclude"]))
+        return mask
+
+    def filter_bitmap(self, data_df, filter_item):
+        """
+        Evaluates a single filter on a dataframe as a packed bitmap, from the index
+        built on its column if there is one and it supports the filter (see
+        modules.bitmap_index), or from its mask otherwise.
+        """
+        index = frame_cache(data_df, "indexes").get(filter_item["column"])
+        # indexes are built on columns as is, not cast to the filter type
+        if index is not None and FILTER_TYPES[filter_item["type"]](
+            data_df[filter_item["column"]].dtype
+        ):
+            bitmap = index.filter_bitmap(filter_item)
+            if bitmap is not None:
+                return bitmap
+        return np.packbits(self.filter_mask(data_df, filter_item))
+
+    def bitmap(self, data_df):
+        """
+        Evaluates the filters on a dataframe as a packed bitmap over its rows (see
+        np.packbits), combining the memoized bitmaps of the individual filters.
+        Filters on columns that are not in the dataframe are ignored.
+        """
+        bitmaps = frame_cache(data_df, "bitmaps")
+        if self.key not in bitmaps:
+            bitmap = np.packbits(np.ones(len(data_df), dtype=bool))
+            for filter_item in self.filters:
+                if filter_item["column"] not in data_df.columns:
+                    continue
+                if filter_item["key"] not in bitmaps:
+                    bitmaps[filter_item["key"]] = self.filter_bitmap(
+                        data_df, filter_item
+                    )
+                bitmap = bitmap & bitmaps[filter_item["key"]]
+            bitmaps[self.key] = bitmap
+        return bitmaps[self.key]
+
+    def mask(self, data_df):
+        """
+        Evaluates the filters on a dataframe as a boolean numpy mask over its rows.
+        """
+        return np.unpackbits(self.bitmap(data_df), count=len(data_df)).astype(bool)
+
 
-    # return the filtered dataframe
-    return data_df[mask]
+@lru_cache(maxsize=None)
+def _compile_filters(config_json):
+    return FilterPlan(json.loads(config_json))
+
+
+def compile_filters(config):
+    """
+    Compiles a filtering config into a FilterPlan (compiled once per distinct config).
+    """
+    return _compile_filters(json.dumps(config, sort_keys=True, default=str))
+
+
+def filter_mask(data_df, config):
+    """
+    Returns a boolean numpy mask of the rows of a dataframe passing the filters.
+    """
+    return compile_filters(config).mask(data_df)
+
+
+def select_rows(data_df, config):
+    """
+    Returns the rows of a dataframe passing the filters as a new dataframe, which can
+    be modified without affecting the original dataframe.
+    """
+    return data_df.take(np.flatnonzero(filter_mask(data_df, config)))
+
+
+def apply_filters(data_df, config, columns=None):
+    """
+    Applies the filters of a filtering config to a dataframe, without modifying it.
+    The dataframe itself is returned if no row is filtered out. Otherwise, if columns
+    is given (e.g. the columns used once filters are applied), only these columns of
+    the rows passing the filters are copied into the filtered dataframe.
+    """
+    mask = filter_mask(data_df, config)
+    if mask.all():
+        return data_df
+    rows = np.flatnonzero(mask)
+    if columns is None:
+        return data_df.take(rows)
+    return data_df.iloc[rows, np.flatnonzero(data_df.columns.isin(columns))]
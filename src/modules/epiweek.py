@@ -0,0 +1,119 @@
+import numpy as np
+import pandas as pd
+
+# first day of the week (0 for Monday to 6 for Sunday) for each week convention, i.e.
+# ISO weeks (Monday to Sunday) and MMWR epidemiological weeks (Sunday to Saturday)
+WEEK_CONVENTIONS = {"iso": 0, "mmwr": 6}
+
+# days weeks can be labelled by, i.e. the Sunday on or before their first day (the
+# Sunday before the Monday of ISO weeks, as in earlier versions, or the first day of
+# MMWR weeks) or their first day
+WEEK_ANCHORS = ["sunday", "start"]
+
+# periods dates can be rolled up to
+PERIODS = ["day", "week", "month", "year"]
+
+# day of the week of 1970-01-01 (day 0 of datetime64), a Thursday
+_EPOCH_WEEKDAY = 3
+
+
+def first_weekday(convention):
+    # first day of the week of a week convention
+    if convention not in WEEK_CONVENTIONS:
+        raise ValueError(
+            f"Unknown week convention '{convention}', expected one of {list(WEEK_CONVENTIONS)}."
+        )
+    return WEEK_CONVENTIONS[convention]
+
+
+def as_days(dates):
+    """
+    Returns dates (any array-like of dates) as a datetime64[D] numpy array, missing
+    dates being NaT.
+    """
+    return np.asarray(pd.to_datetime(dates), dtype="datetime64[ns]").astype(
+        "datetime64[D]"
+    )
+
+
+def week_start(dates, convention="iso"):
+    """
+    Returns the first day of the week of each date, as a datetime64[D] numpy array.
+    """
+    days = as_days(dates)
+    day_numbers = days.astype(np.int64)
+    weekdays = (day_numbers + _EPOCH_WEEKDAY) % 7
+    starts = day_numbers - (weekdays - first_weekday(convention)) % 7
+    return np.where(np.isnat(days), days, starts.astype("datetime64[D]"))
+
+
+def week_label(dates, convention="iso", anchor="sunday"):
+    """
+    Returns the day labelling the week of each date (see WEEK_ANCHORS), as a
+    datetime64[D] numpy array.
+    """
+    starts = week_start(dates, convention)
+    if anchor == "start":
+        return starts
+    if anchor != "sunday":
+        raise ValueError(
+            f"Unknown week anchor '{anchor}', expected one of {WEEK_ANCHORS}."
+        )
+    # the Sunday on or before the first day of the week
+    return starts - np.timedelta64((first_weekday(convention) + 1) % 7, "D")
+
+
+def config_period(config, default=None):
+    """
+    Returns the period dates are rolled up to (see PERIODS), the week convention and
+    the week anchor set by a (section or aggregation) config, i.e. its period (or
+    'week' if by_epiweek is set, default otherwise), week_convention ('iso' by default)
+    and week_anchor ('sunday' by default, see WEEK_ANCHORS).
+    """
+    period = config.get("period") or (
+        "week" if config.get("by_epiweek", False) else default
+    )
+    return (
+        period,
+        config.get("week_convention", "iso"),
+        config.get("week_anchor", "sunday"),
+    )
+
+
+def period_start(dates, period="day", convention="iso", anchor="sunday"):
+    """
+    Rolls dates up to the first day of their period (day, week, month or year), weeks
+    being labelled by their anchor (see week_label), as a datetime64[ns] numpy array,
+    missing dates being NaT.
+    """
+    if period == "day":
+        starts = as_days(dates)
+    elif period == "week":
+        starts = week_label(dates, convention, anchor)
+    elif period == "month":
+        starts = as_days(dates).astype("datetime64[M]").astype("datetime64[D]")
+    elif period == "year":
+        starts = as_days(dates).astype("datetime64[Y]").astype("datetime64[D]")
+    else:
+        raise ValueError(f"Unknown period '{period}', expected one of {PERIODS}.")
+    return starts.astype("datetime64[ns]")
+
+
+def period_frequency(period="day", convention="iso", anchor="sunday"):
+    """
+    Returns the pandas frequency of the first days of a period (see period_start).
+    """
+    if period == "week":
+        weekday = 6 if anchor == "sunday" else first_weekday(convention)
+        return "W-%s" % ["MON", "TUE", "WED", "THU", "FRI", "SAT", "SUN"][weekday]
+    frequencies = {"day": "D", "month": "MS", "year": "YS"}
+    if period not in frequencies:
+        raise ValueError(f"Unknown period '{period}', expected one of {PERIODS}.")
+    return frequencies[period]
+
+
+def period_range(start, end, period="day", convention="iso", anchor="sunday"):
+    """
+    Returns the first day of every period (see period_start) from start to end.
+    """
+    return pd.date_range(start, end, freq=period_frequency(period, convention, anchor))
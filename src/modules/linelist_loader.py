@@ -0,0 +1,361 @@
+import os
+import json
+import fnmatch
+import hashlib
+import pandas as pd
+from pathlib import Path
+from typing import Dict
+
+# default schema for linelists exported from InsightBoard
+# keys are column names or glob patterns, values are schema types (see PANDAS_DTYPES)
+# or any dtype understood by pandas (e.g. 'Int16'), null leaves the column to pandas
+DEFAULT_LINELIST_SCHEMA: Dict[str, str] = {
+    "record_id": "str",
+    "loc_admin_*": "category",
+    "case_classification": "category",
+    "case_status": "category",
+    "sex_at_birth": "category",
+    "clade": "category",
+    "lineage": "category",
+    "*_date": "date",
+    "date_of_*": "date",
+    "health_worker": "bool",
+    "sex_worker": "bool",
+    "age_years": "Int16",
+    "age_months": "Int16",
+}
+
+# number of rows per chunk when reading a linelist in chunks
+DEFAULT_CHUNKSIZE = 100000
+
+# pandas dtypes for each schema type (dates are parsed separately)
+PANDAS_DTYPES: Dict[str, str] = {
+    "category": "category",
+    "str": "object",
+    "bool": "boolean",
+    "int": "Int64",
+    "float": "float64",
+}
+
+# pandas dtypes parsed at read time, which accept any value (other types are coerced
+# once read, see coerce_columns)
+READ_TIME_DTYPES = {"category", "object", "str", "string"}
+
+# values of boolean columns (case-insensitive), other values being missing
+BOOLEAN_VALUES = {
+    "true": True,
+    "false": False,
+    "t": True,
+    "f": False,
+    "yes": True,
+    "no": False,
+    "y": True,
+    "n": False,
+    "1": True,
+    "0": False,
+}
+
+
+def resolve_schema(columns, schema=None):
+    """
+    Resolves a (possibly pattern-based) schema against the columns of a linelist.
+    Entries of a user schema take precedence over the default schema.
+    """
+    schema = schema or {}
+    # user-defined entries first, so that their patterns are matched first
+    merged_schema = dict(schema)
+    for key, column_type in DEFAULT_LINELIST_SCHEMA.items():
+        merged_schema.setdefault(key, column_type)
+
+    column_types = {}
+    for column in columns:
+        # exact matches take precedence over patterns
+        if column in merged_schema:
+            column_type = merged_schema[column]
+        else:
+            column_type = next(
+                (
+                    column_type
+                    for pattern, column_type in merged_schema.items()
+                    if fnmatch.fnmatchcase(column, pattern)
+                ),
+                None,
+            )
+        if column_type is not None:
+            column_types[column] = column_type
+
+    return column_types
+
+
+def project_columns(available_columns, columns=None):
+    """
+    Returns the subset of available columns to load given the columns required
+    (None to load all columns). At least one column is always kept so that the
+    number of rows is preserved.
+    """
+    if columns is None:
+        return list(available_columns)
+    projected_columns = [column for column in available_columns if column in columns]
+    return projected_columns or list(available_columns[:1])
+
+
+def read_options(linelist_file, schema=None, columns=None):
+    """
+    Builds the keyword arguments for pd.read_csv such that only the required columns
+    are read and every column is typed at read time according to the schema. Also
+    returns the types of the columns that are only coerced once read (see
+    coerce_columns), i.e. dates, booleans and numbers, which read_csv would fail to
+    parse at read time on any malformed entry.
+    """
+    # read only the header to resolve the schema
+    columns = project_columns(pd.read_csv(linelist_file, nrows=0).columns, columns)
+    column_types = resolve_schema(columns, schema)
+
+    dtype = {}
+    coerced_types = {}
+    for column, column_type in column_types.items():
+        pandas_dtype = PANDAS_DTYPES.get(column_type, column_type)
+        if column_type != "date" and pandas_dtype in READ_TIME_DTYPES:
+            dtype[column] = pandas_dtype
+        else:
+            coerced_types[column] = column_type
+            if column_type != "date":
+                dtype[column] = "object"
+    date_columns = [
+        column for column, column_type in column_types.items() if column_type == "date"
+    ]
+
+    options = {"usecols": columns, "dtype": dtype, "parse_dates": date_columns}
+    return options, coerced_types
+
+
+def coerce_column(values, column_type):
+    # coerce the values of a column to its schema type, with invalid values set to NA
+    if column_type == "date":
+        if pd.api.types.is_datetime64_any_dtype(values):
+            return values
+        return pd.to_datetime(values, errors="coerce")
+    if column_type == "bool":
+        return (
+            values.astype("string")
+            .str.strip()
+            .str.lower()
+            .map(BOOLEAN_VALUES)
+            .astype("boolean")
+        )
+    pandas_dtype = PANDAS_DTYPES.get(column_type, column_type)
+    numbers = pd.to_numeric(values, errors="coerce")
+    try:
+        return numbers.astype(pandas_dtype)
+    except (TypeError, ValueError):
+        # e.g. non-integer values of an integer column, kept as floats
+        return numbers
+
+
+def coerce_columns(linelist, column_types):
+    """
+    Coerces the columns that are not typed at read time (see read_options) to their
+    schema type, with invalid values (e.g. malformed dates, or 'unknown' ages) set to
+    NA rather than failing to load the linelist.
+    """
+    for column, column_type in column_types.items():
+        if column in linelist.columns:
+            linelist[column] = coerce_column(linelist[column], column_type)
+    return linelist
+
+
+def linelist_fingerprint(linelist_file, schema=None):
+    """
+    Computes a fingerprint of a linelist file from its path, size and modification
+    time, together with the schema used to type it.
+    """
+    stat = os.stat(linelist_file)
+    key = [str(Path(linelist_file).resolve()), stat.st_size, stat.st_mtime_ns, schema]
+    return hashlib.sha256(
+        json.dumps(key, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+def read_cached_linelist(cache_file, columns=None):
+    """
+    Reads a typed linelist from a columnar cache file (Arrow IPC) using memory-mapping,
+    converting only the required columns.
+    """
+    from pyarrow import feather
+
+    table = feather.read_table(str(cache_file), memory_map=True)
+    return table.select(project_columns(table.column_names, columns)).to_pandas()
+
+
+def write_cached_linelist(linelist, cache_file):
+    """
+    Writes a typed linelist to a columnar cache file (Arrow IPC), uncompressed so
+    that it can be memory-mapped when read back.
+    """
+    # write to a temporary file first so that concurrent runs never see a partial file
+    tmp_file = cache_file.with_suffix(".%d.tmp" % os.getpid())
+    linelist.to_feather(tmp_file, compression="uncompressed")
+    os.replace(tmp_file, cache_file)
+
+
+def cache_schema(chunk):
+    """
+    Returns the Arrow schema of the columnar cache of a linelist written in chunks
+    (see write_cached_chunks), i.e. the schema of its first chunk with dictionary
+    indices wide enough for the categories of any chunk, and columns with no values in
+    the first chunk typed as strings.
+    """
+    import pyarrow as pa
+
+    schema = pa.Schema.from_pandas(chunk, preserve_index=False)
+    for i, field in enumerate(schema):
+        if pa.types.is_dictionary(field.type):
+            value_type = field.type.value_type
+            if pa.types.is_null(value_type):
+                value_type = pa.string()
+            schema = schema.set(
+                i, field.with_type(pa.dictionary(pa.int32(), value_type))
+            )
+        elif pa.types.is_null(field.type):
+            schema = schema.set(i, field.with_type(pa.string()))
+    return schema
+
+
+def write_cached_chunks(chunks, cache_file):
+    """
+    Writes the chunks of a typed linelist to a columnar cache file (Arrow IPC) as they
+    are read, yielding them unchanged, so that reading a linelist in chunks fills the
+    cache in the same pass. The cache file only appears once the last chunk is
+    written, and is not written at all if a chunk cannot be appended to it (e.g. a
+    column of integers holding decimals further down, or a categorical column with no
+    values in the first chunk).
+    """
+    import pyarrow as pa
+
+    # write to a temporary file first so that concurrent runs never see a partial file
+    tmp_file = cache_file.with_suffix(".%d.tmp" % os.getpid())
+    writer = schema = None
+    writing = True
+    # categories of each categorical column so far, only ever extended as an Arrow IPC
+    # file holds a single dictionary per column (extended by deltas)
+    categories = {}
+    try:
+        for chunk in chunks:
+            if writing:
+                cached_chunk = chunk.copy(deep=False)
+                for column in chunk.select_dtypes("category").columns:
+                    chunk_categories = chunk[column].cat.categories
+                    known_categories = categories.get(column, chunk_categories[:0])
+                    categories[column] = known_categories.append(
+                        chunk_categories[~chunk_categories.isin(known_categories)]
+                    )
+                    cached_chunk[column] = chunk[column].cat.set_categories(
+                        categories[column]
+                    )
+                try:
+                    if writer is None:
+                        schema = cache_schema(cached_chunk)
+                        writer = pa.ipc.new_file(
+                            str(tmp_file),
+                            schema,
+                            options=pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True),
+                        )
+                    writer.write_table(
+                        pa.Table.from_pandas(cached_chunk, preserve_index=False).cast(
+                            schema
+                        )
+                    )
+                except (
+                    pa.ArrowInvalid,
+                    pa.ArrowTypeError,
+                    pa.ArrowNotImplementedError,
+                ):
+                    writing = False
+                    if writer is not None:
+                        writer.close()
+                        writer = None
+                    tmp_file.unlink(missing_ok=True)
+            yield chunk
+        if writer is not None:
+            writer.close()
+            writer = None
+            os.replace(tmp_file, cache_file)
+    finally:
+        # reading stopped before the last chunk
+        if writer is not None:
+            writer.close()
+            tmp_file.unlink(missing_ok=True)
+
+
+def cached_linelist_file(linelist_file, schema, cache_dir):
+    """
+    Returns the path of the columnar cache file of a linelist file in cache_dir.
+    """
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        raise ImportError(
+            "Caching the linelist requires pyarrow, install it with 'pip install pyarrow'."
+        )
+    Path(cache_dir).mkdir(exist_ok=True, parents=True)
+    return Path(cache_dir) / f"{linelist_fingerprint(linelist_file, schema)}.arrow"
+
+
+def iter_linelist(
+    linelist_file,
+    schema=None,
+    cache_dir=None,
+    columns=None,
+    chunksize=DEFAULT_CHUNKSIZE,
+):
+    """
+    Reads a linelist file (.csv) in chunks of (at most) chunksize rows, each typed
+    according to the schema, so that the whole linelist never has to fit in memory.
+    If cache_dir is given, chunks are read from the columnar cache of the linelist in
+    cache_dir, or the cache is written as the linelist is read (see load_linelist).
+    """
+    if cache_dir is None:
+        options, coerced_types = read_options(linelist_file, schema, columns)
+        with pd.read_csv(linelist_file, chunksize=chunksize, **options) as reader:
+            for chunk in reader:
+                yield coerce_columns(chunk, coerced_types)
+        return
+
+    cache_file = cached_linelist_file(linelist_file, schema, cache_dir)
+    if cache_file.exists():
+        from pyarrow import feather
+
+        table = feather.read_table(str(cache_file), memory_map=True)
+        table = table.select(project_columns(table.column_names, columns))
+        for batch in table.to_batches(max_chunksize=chunksize):
+            yield batch.to_pandas()
+        return
+
+    # the cache holds every column, so that it can serve any projection
+    options, coerced_types = read_options(linelist_file, schema)
+    with pd.read_csv(linelist_file, chunksize=chunksize, **options) as reader:
+        chunks = (coerce_columns(chunk, coerced_types) for chunk in reader)
+        for chunk in write_cached_chunks(chunks, cache_file):
+            yield chunk[project_columns(chunk.columns, columns)]
+
+
+def load_linelist(linelist_file, schema=None, cache_dir=None, columns=None):
+    """
+    Loads a linelist file (.csv) with all columns typed once at read time.
+    If columns is given, only those columns (if present) are loaded.
+    If cache_dir is given, the typed linelist is cached there in a columnar format,
+    keyed by the fingerprint of the linelist file, and reused on subsequent runs.
+    The cache always holds every column, so that it can serve any projection.
+    """
+    if cache_dir is not None:
+        cache_file = cached_linelist_file(linelist_file, schema, cache_dir)
+        if not cache_file.exists():
+            options, coerced_types = read_options(linelist_file, schema)
+            linelist = pd.read_csv(linelist_file, **options)
+            write_cached_linelist(coerce_columns(linelist, coerced_types), cache_file)
+        return read_cached_linelist(cache_file, columns)
+
+    options, coerced_types = read_options(linelist_file, schema, columns)
+    linelist = pd.read_csv(linelist_file, **options)
+
+    return coerce_columns(linelist, coerced_types)
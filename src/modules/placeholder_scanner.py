@@ -0,0 +1,124 @@
+import re
+from itertools import chain
+
+# regular expression to match variables enclosed in {{ }}, optionally followed by
+# parameters in brackets, e.g. {{ total_deaths[loc_admin_1=South Kivu] }}
+PLACEHOLDER_PATTERN = re.compile(r"{{\s*(\w+)\s*(?:\[([^\[\]{}]*)\])?\s*}}")
+
+# start of a placeholder, of a script (whose body is not scanned) or of a data URI
+# (e.g. a base64 encoded image, not scanned either)
+_TOKEN_PATTERN = re.compile(r"{{|<script\b|(?<=[\"'(=])data:", re.IGNORECASE)
+_SCRIPT_END_PATTERN = re.compile(r"</script", re.IGNORECASE)
+_DATA_URI_END_PATTERN = re.compile(r"[\"'()<>\s]")
+
+# longest text scanned for the end of a placeholder
+MAX_PLACEHOLDER_LENGTH = 1024
+# number of characters kept at the end of a chunk in case a token is split across chunks
+_TOKEN_OVERLAP = len("</script")
+# number of characters before a token that _TOKEN_PATTERN looks behind
+_LOOKBEHIND = 1
+
+
+def read_chunks(file, chunk_size=1 << 16):
+    """
+    Reads a text file in chunks (of chunk_size characters).
+    """
+    with open(file, "r", encoding="utf-8") as f:
+        while chunk := f.read(chunk_size):
+            yield chunk
+
+
+def iter_segments(chunks):
+    """
+    Splits an HTML document, given as an iterable of text chunks (e.g. see read_chunks),
+    into segments, yielding (text, match) pairs where match is the PLACEHOLDER_PATTERN
+    match of a placeholder, or None for text to be copied as is. Only a chunk (and any
+    placeholder split across chunks) is held in memory at a time. The bodies of <script>
+    elements (e.g. inline Plotly figures) and data URIs (e.g. base64 encoded images)
+    are copied as is without being scanned for placeholders.
+    """
+    buffer, mode, position = "", "text", 0
+    for chunk in chain(chunks, [None]):
+        end_of_input = chunk is None
+        if not end_of_input:
+            buffer += chunk
+
+        while position < len(buffer):
+            if mode == "script":
+                # copy the script up to its end
+                script_end = _SCRIPT_END_PATTERN.search(buffer, position)
+                if script_end is None:
+                    end = len(buffer) if end_of_input else len(buffer) - _TOKEN_OVERLAP
+                    if end > position:
+                        yield buffer[position:end], None
+                        position = end
+                    break
+                yield buffer[position : script_end.start()], None
+                yield script_end.group(0), None
+                position, mode = script_end.end(), "text"
+
+            elif mode == "data":
+                # copy the data URI up to its end
+                data_end = _DATA_URI_END_PATTERN.search(buffer, position)
+                if data_end is None:
+                    yield buffer[position:], None
+                    position = len(buffer)
+                    break
+                yield buffer[position : data_end.start()], None
+                position, mode = data_end.start(), "text"
+
+            else:
+                token = _TOKEN_PATTERN.search(buffer, position)
+                if token is None:
+                    end = len(buffer) if end_of_input else len(buffer) - _TOKEN_OVERLAP
+                    if end > position:
+                        yield buffer[position:end], None
+                        position = end
+                    break
+                if token.start() > position:
+                    yield buffer[position : token.start()], None
+                position = token.start()
+
+                if token.group(0) == "{{":
+                    match = PLACEHOLDER_PATTERN.match(buffer, position)
+                    if match is not None:
+                        yield match.group(0), match
+                        position = match.end()
+                        continue
+                    # wait for the next chunk if the placeholder may not be complete yet
+                    if (
+                        not end_of_input
+                        and "}}" not in buffer[position:]
+                        and len(buffer) - position < MAX_PLACEHOLDER_LENGTH
+                    ):
+                        break
+                    yield "{{", None
+                    position += 2
+                else:
+                    yield token.group(0), None
+                    position = token.end()
+                    mode = "script" if token.group(0).startswith("<") else "data"
+
+        # keep the character before the position (already copied), which the start of a
+        # data URI is matched against (see _TOKEN_PATTERN)
+        kept = min(position, _LOOKBEHIND)
+        buffer, position = buffer[position - kept :], kept
+
+
+def iter_placeholders(chunks):
+    """
+    Returns the PLACEHOLDER_PATTERN matches of the placeholders in an HTML document,
+    given as an iterable of text chunks (see iter_segments).
+    """
+    for _, match in iter_segments(chunks):
+        if match is not None:
+            yield match
+
+
+def placeholders_text(chunks):
+    """
+    Returns the placeholders of an HTML document, given as an iterable of text chunks
+    (see iter_segments), concatenated into a string, e.g. to plan the columns and
+    variables needed to populate a large document without reading it in memory.
+    """
+    return " ".join(match.group(0) for match in iter_placeholders(chunks))
@@ -0,0 +1,90 @@
+from collections.abc import Mapping
+from importlib import import_module
+from importlib.metadata import entry_points
+
+# entry point group under which other packages can register their own plot types,
+# each entry point naming a module (or object) with aggregate, finalize and plot
+# functions, e.g. in pyproject.toml:
+# [project.entry-points."insightboard_reporting.plot_types"]
+# epicurve = "my_package.epicurve"
+PLOT_TYPES_ENTRY_POINT_GROUP = "insightboard_reporting.plot_types"
+
+# modules implementing the built-in plot types
+BUILTIN_PLOT_TYPES = {
+    "time-series-barplot": "plotting_modules.time_series_barplot",
+    "spatial-map": "plotting_modules.spatial_map",
+    "age-sex-pyramid": "plotting_modules.age_sex_pyramid",
+}
+
+
+class PlotTypeRegistry(Mapping):
+    """
+    Registry of plot types, mapping each plot type to the functions preprocessing and
+    plotting its data: aggregate (counts from data, which can be combined across chunks
+    of data), finalize (counts to plot data), plot (plot data to HTML) and, optionally,
+    columns (linelist columns used by a section) and variables (template variables
+    computed from the counts of a section). The module implementing a plot type
+    (and the plotting libraries it depends on) is only imported when the plot type is
+    looked up, i.e. when a section of this type is created. Besides the built-in plot
+    types, plot types are discovered from the PLOT_TYPES_ENTRY_POINT_GROUP entry points
+    of the installed packages.
+    """
+
+    def __init__(self, modules=None, group=PLOT_TYPES_ENTRY_POINT_GROUP):
+        self.modules = dict(BUILTIN_PLOT_TYPES if modules is None else modules)
+        self.group = group
+        self.entry_points = None
+        self.plot_types = {}
+
+    def discover(self):
+        # entry points of installed packages (scanned once, and only when a plot type
+        # is not built in)
+        if self.entry_points is None:
+            self.entry_points = {
+                entry_point.name: entry_point
+                for entry_point in entry_points(group=self.group)
+                if entry_point.name not in self.modules
+            }
+        return self.entry_points
+
+    def register(self, name, module):
+        """
+        Registers a plot type implemented by a module (or its import path).
+        """
+        self.modules[name] = module
+        self.plot_types.pop(name, None)
+
+    def __contains__(self, name):
+        return name in self.modules or name in self.discover()
+
+    def __iter__(self):
+        yield from self.modules
+        yield from self.discover()
+
+    def __len__(self):
+        return len(self.modules) + len(self.discover())
+
+    def __getitem__(self, name):
+        if name not in self.plot_types:
+            if name in self.modules:
+                module = self.modules[name]
+                if isinstance(module, str):
+                    module = import_module(module)
+            elif name in self.discover():
+                module = self.entry_points[name].load()
+            else:
+                raise KeyError(name)
+            plot_type = {
+                "aggregate": module.aggregate,
+                "finalize": module.finalize,
+                "plot": module.plot,
+            }
+            for hook in ["columns", "variables"]:
+                if hasattr(module, hook):
+                    plot_type[hook] = getattr(module, hook)
+            self.plot_types[name] = plot_type
+        return self.plot_types[name]
+
+
+# plot types available to reports
+PLOT_TYPES = PlotTypeRegistry()
@@ -1,230 +1,727 @@
-import re
+import math
+import numpy as np
 import pandas as pd
 from typing import Dict
 
+from modules.aggregation import combine_counts, subtract_counts
+from modules.data_filtering import apply_filters, frame_cache
+from modules.placeholder_scanner import (
+    iter_placeholders,
+    iter_segments,
+    read_chunks,
+)
+
+
+def parse_parameters(parameters):
+    """
+    Parses the (comma-separated) parameters of a placeholder into the columns to group
+    by (e.g. 'loc_admin_1') and the scope, i.e. the (column, value) pairs that rows
+    must match (e.g. 'loc_admin_1=South Kivu').
+    """
+    group_by, scope = [], []
+    for parameter in parameters.split(","):
+        if "=" in parameter:
+            column, value = parameter.split("=", 1)
+            scope.append((column.strip(), value.strip()))
+        elif parameter.strip():
+            group_by.append(parameter.strip())
+    return tuple(group_by), tuple(sorted(scope))
+
+
+def placeholder_key(variable_name, group_by, scope):
+    # normalized name of a parameterized placeholder, e.g. 'total_deaths[loc_admin_1=South Kivu]'
+    parameters = list(group_by) + ["%s=%s" % (column, value) for column, value in scope]
+    return "%s[%s]" % (variable_name, ",".join(parameters))
+
+
+def placeholder_columns(group_by, scope):
+    # columns referenced by the parameters of a placeholder
+    return set(group_by) | {column for column, _ in scope}
+
+
+def variables_columns(data, variable_names):
+    # columns of a linelist referenced by the given variables
+    return {
+        column
+        for variable_name in variable_names
+        for column in VARIABLES[variable_name]["columns"]
+        if column in data.columns
+    }
+
+
+def summarise(data, variable_names=None, dimensions=None):
+    """
+    Summarises a linelist into what is needed to compute variables, i.e. the number of
+    rows and the value counts of each column referenced by the given variables (all
+    variables if None), and the count cube over the given dimensions (see
+    summarise_cube) if any (dimensions that are not columns of the linelist being
+    left out). Summaries of different chunks of a linelist can be
+    combined with combine_summaries. Value counts of columns with a bitmap index (see
+    modules.bitmap_index) are read from the index.
+    """
+    if variable_names is None:
+        variable_names = VARIABLES.keys()
+    indexes = frame_cache(data, "indexes")
+    summary = {
+        "total": len(data),
+        "counts": {
+            column: (
+                indexes[column].value_counts()
+                if column in indexes
+                else data[column].value_counts(dropna=False)
+            )
+            for column in variables_columns(data, variable_names)
+        },
+    }
+    dimensions = set(dimensions or ()) & set(data.columns)
+    if dimensions:
+        summary["cube"] = summarise_cube(data, dimensions, variable_names)
+    return summary
+
+
+def summarise_cube(data, dimensions, variable_names):
+    """
+    Summarises a linelist into a count cube over the given dimensions (columns), i.e.
+    the number of rows for each combination of values of the dimensions, and for each
+    column referenced by the given variables, the number of rows for each combination
+    of values of the dimensions and the column. Any scope of the dimensions can then
+    be summarised from the cube (see scope_summary), at the cost of one groupby per
+    column for all scopes.
+    """
+    dimensions = sorted(dimensions)
+    total = data.groupby(dimensions, observed=True, dropna=False).size()
+    return {
+        "dimensions": dimensions,
+        "total": total,
+        "counts": {
+            column: (
+                # counts over a dimension are already in the total
+                total
+                if column in dimensions
+                else data.groupby(
+                    dimensions + [column], observed=True, dropna=False
+                ).size()
+            )
+            for column in variables_columns(data, variable_names)
+        },
+    }
+
+
+def merge_summaries(summary, other, subtract=False):
+    # add (or subtract) the totals and counts of two summaries, and of their count
+    # cubes if both have one
+    merge_counts = subtract_counts if subtract else combine_counts
+    merged_summary = {
+        "total": summary["total"] + (-other["total"] if subtract else other["total"]),
+        "counts": {
+            column: merge_counts(
+                summary["counts"].get(column), other["counts"].get(column)
+            )
+            for column in summary["counts"].keys() | other["counts"].keys()
+        },
+    }
+    if "cube" in summary and "cube" in other:
+        merged_summary["cube"] = {
+            "dimensions": summary["cube"]["dimensions"],
+            "total": merge_counts(summary["cube"]["total"], other["cube"]["total"]),
+            "counts": {
+                column: merge_counts(
+                    summary["cube"]["counts"].get(column),
+                    other["cube"]["counts"].get(column),
+                )
+                for column in summary["cube"]["counts"].keys()
+                | other["cube"]["counts"].keys()
+            },
+        }
+    return merged_summary
+
+
+def combine_summaries(summary, other):
+    """
+    Combines the summaries of two chunks of a linelist (either may be None).
+    """
+    if summary is None:
+        return other
+    if other is None:
+        return summary
+    return merge_summaries(summary, other)
+
+
+def subtract_summaries(summary, other):
+    """
+    Subtracts the summary of rows removed from a linelist (e.g. outdated versions of
+    updated records) from the summary of the linelist (either may be None).
+    """
+    if other is None:
+        return summary
+    if summary is None:
+        summary = {"total": 0, "counts": {}}
+    return merge_summaries(summary, other, subtract=True)
+
+
+def summarise_chunks(data_chunks, variable_names=None, dimensions=None):
+    """
+    Summarises a linelist read in chunks, keeping only the summary in memory.
+    """
+    summary = None
+    for data_chunk in data_chunks:
+        summary = combine_summaries(
+            summary, summarise(data_chunk, variable_names, dimensions)
+        )
+    return summary
+
+
+def summarise_filtered_chunks(
+    data_chunks, filtering_configs, variable_names=None, dimensions=None
+):
+    """
+    Summarises a linelist read in chunks once for each of the given filtering configs
+    (e.g. one per district), in a single pass over the chunks.
+    """
+    summaries = [None] * len(filtering_configs)
+    for data_chunk in data_chunks:
+        # columns summarised once filters are applied
+        columns = variables_columns(
+            data_chunk, variable_names or VARIABLES.keys()
+        ) | set(dimensions or ())
+        for index, filtering_config in enumerate(filtering_configs):
+            summaries[index] = combine_summaries(
+                summaries[index],
+                summarise(
+                    apply_filters(data_chunk, filtering_config, columns),
+                    variable_names,
+                    dimensions,
+                ),
+            )
+    return summaries
+
+
+# function to select the counts of a count cube within a scope ((column, value) pairs,
+# values being compared as strings)
+def scope_counts(counts, scope):
+    mask = np.ones(len(counts), dtype=bool)
+    for column, value in scope:
+        mask &= counts.index.get_level_values(column).astype(str) == value
+    return counts[mask]
+
+
+def scope_summary(cube, scope):
+    """
+    Summarises the rows of a linelist within a scope, i.e. matching (column, value)
+    pairs over dimensions of a count cube, from the cube. The summary has the same
+    format as those returned by summarise.
+    """
+    return {
+        "total": int(scope_counts(cube["total"], scope).sum()),
+        "counts": {
+            column: scope_counts(counts, scope)
+            .groupby(level=column, observed=True, dropna=False)
+            .sum()
+            for column, counts in cube["counts"].items()
+        },
+    }
+
+
+# function to count the number of rows with a given value in a column
+def count_value(summary, column, value):
+    return int(summary["counts"][column].get(value, 0))
+
+
+# function to get the non-missing values of a column sorted with their cumulative counts,
+# computed once per summary and shared by all the quantiles of the column
+def sorted_counts(summary, column):
+    sorted_counts_cache = summary.setdefault("sorted_counts", {})
+    if column not in sorted_counts_cache:
+        value_counts = summary["counts"][column]
+        value_counts = value_counts[value_counts.index.notna()].sort_index()
+        value_counts = value_counts[value_counts > 0]
+        sorted_counts_cache[column] = (
+            value_counts.index.to_numpy(dtype=float),
+            value_counts.cumsum().to_numpy(),
+        )
+    return sorted_counts_cache[column]
+
+
+# function to compute a quantile (with linear interpolation) of a column from its value counts
+def quantile(summary, column, q):
+    values, cumulative_counts = sorted_counts(summary, column)
+    if len(values) == 0:
+        return float("nan")
+    # position of the quantile in the sorted values
+    position = (cumulative_counts[-1] - 1) * q
+    lower, upper = math.floor(position), math.ceil(position)
+    lower_value, upper_value = values[
+        np.searchsorted(cumulative_counts, [lower, upper], "right")
+    ]
+    return lower_value + (position - lower) * (upper_value - lower_value)
+
 
 # function to compute total number of cases (all classifications)
-def total_cases(data):
-    return len(data)
+def total_cases(summary):
+    return summary["total"]
 
 
 # function to compute total number of deaths
-def total_deaths(data):
-    return len(data[data["case_status"] == "died"])
+def total_deaths(summary):
+    return count_value(summary, "case_status", "died")
 
 
 # function to compute total number of confirmed cases
-def total_confirmed_cases(data):
-    return len(data[data["case_classification"] == "confirmed"])
+def total_confirmed_cases(summary):
+    return count_value(summary, "case_classification", "confirmed")
 
 
 # function to compute total number of probable cases
-def total_probable_cases(data):
-    return len(data[data["case_classification"] == "probable"])
+def total_probable_cases(summary):
+    return count_value(summary, "case_classification", "probable")
 
 
 # function to compute total number of suspected cases
-def total_suspected_cases(data):
-    return len(data[data["case_classification"] == "suspected"])
+def total_suspected_cases(summary):
+    return count_value(summary, "case_classification", "suspected")
 
 
 # function to compute total number of negative cases
-def total_negative_cases(data):
-    return len(data[data["case_classification"] == "negative"])
+def total_negative_cases(summary):
+    return count_value(summary, "case_classification", "negative")
 
 
 # function to compute total number of unknown cases
-def total_unknown_cases(data):
-    return len(data[data["case_classification"] == "unknown"])
+def total_unknown_cases(summary):
+    return count_value(summary, "case_classification", "unknown")
 
 
 # function to compute total number of male cases (all classifications)
-def total_male_cases(data):
-    total_male_count = len(data[data["sex_at_birth"] == "male"])
-    return total_male_count
+def total_male_cases(summary):
+    return count_value(summary, "sex_at_birth", "male")
 
 
 # function to compute total number of female cases (all classifications)
-def total_female_cases(data):
-    total_female_count = len(data[data["sex_at_birth"] == "female"])
-    return total_female_count
+def total_female_cases(summary):
+    return count_value(summary, "sex_at_birth", "female")
 
 
 # function to compute total number of health workers among all cases (all classifications)
-def total_health_workers(data):
-    total_health_workers_count = len(data[data["health_worker"] == True])  # noqa: E712
-    return total_health_workers_count
+def total_health_workers(summary):
+    return count_value(summary, "health_worker", True)
 
 
 # function to compute total number of sex workers among all cases (all classifications)
-def total_sex_workers(data):
-    total_sex_workers_count = len(data[data["sex_worker"] == True])  # noqa: E712
-    return total_sex_workers_count
+def total_sex_workers(summary):
+    return count_value(summary, "sex_worker", True)
 
 
 # function to compute median age among all cases (all classifications)
-def total_median_age(data):
-    return int(data["age_years"].median())
+def total_median_age(summary):
+    return int(quantile(summary, "age_years", 0.5))
 
 
 # function to compute lower quartile age among all cases (all classifications)
-def total_lower_quartile_age(data):
-    return int(data["age_years"].quantile(0.25))
+def total_lower_quartile_age(summary):
+    return int(quantile(summary, "age_years", 0.25))
 
 
 # function to compute upper quartile age among all cases (all classifications)
-def total_upper_quartile_age(data):
-    return int(data["age_years"].quantile(0.75))
+def total_upper_quartile_age(summary):
+    return int(quantile(summary, "age_years", 0.75))
 
 
 # function to get date of earliest case by date of notification
-def earliest_case_date(data):
-    # convert notification date to datetime
-    data["notification_date"] = pd.to_datetime(data["notification_date"])
+def earliest_case_date(summary):
+    notification_dates = summary["counts"]["notification_date"].index
+    # convert notification date to datetime (unless already parsed at load time)
+    if not pd.api.types.is_datetime64_any_dtype(notification_dates):
+        notification_dates = pd.to_datetime(notification_dates)
     # return the minimum date
-    return data["notification_date"].min().strftime("%Y-%m-%d")
+    return notification_dates.min().strftime("%Y-%m-%d")
 
 
 # dictionary of variables that can be computed
 VARIABLES: Dict[str, Dict] = {
     "total_cases": {
-        "function": lambda data: total_cases(data),
+        "function": lambda summary: total_cases(summary),
         "description": "Total number of cases (regardless of case classification) in the linelist.",
+        "columns": [],
     },
     "total_deaths": {
-        "function": lambda data: total_deaths(data),
+        "function": lambda summary: total_deaths(summary),
         "description": "Total number of deaths in the linelist.",
+        "columns": ["case_status"],
     },
     "total_deaths_percentage": {
-        "function": lambda data: "%.2f"
-        % (total_deaths(data) / total_cases(data) * 100),
+        "function": lambda summary: "%.2f"
+        % (total_deaths(summary) / total_cases(summary) * 100),
         "description": "Percentage of total cases that resulted in death.",
+        "columns": ["case_status"],
     },
     "total_confirmed_cases": {
-        "function": lambda data: total_confirmed_cases(data),
+        "function": lambda summary: total_confirmed_cases(summary),
         "description": "Total number of confirmed cases in the linelist.",
+        "columns": ["case_classification"],
     },
     "total_confirmed_cases_percentage": {
-        "function": lambda data: "%.2f"
-        % (total_confirmed_cases(data) / total_cases(data) * 100),
+        "function": lambda summary: "%.2f"
+        % (total_confirmed_cases(summary) / total_cases(summary) * 100),
         "description": "Percentage of total cases that are confirmed.",
+        "columns": ["case_classification"],
     },
     "total_probable_cases": {
-        "function": lambda data: total_probable_cases(data),
+        "function": lambda summary: total_probable_cases(summary),
         "description": "Total number of probable cases in the linelist.",
+        "columns": ["case_classification"],
     },
     "total_probable_cases_percentage": {
-        "function": lambda data: "%.2f"
-        % (total_probable_cases(data) / total_cases(data) * 100),
+        "function": lambda summary: "%.2f"
+        % (total_probable_cases(summary) / total_cases(summary) * 100),
         "description": "Percentage of total cases that are probable.",
+        "columns": ["case_classification"],
     },
     "total_suspected_cases": {
-        "function": lambda data: total_suspected_cases(data),
+        "function": lambda summary: total_suspected_cases(summary),
         "description": "Total number of suspected cases in the linelist.",
+        "columns": ["case_classification"],
     },
     "total_suspected_cases_percentage": {
-        "function": lambda data: "%.2f"
-        % (total_suspected_cases(data) / total_cases(data) * 100),
+        "function": lambda summary: "%.2f"
+        % (total_suspected_cases(summary) / total_cases(summary) * 100),
         "description": "Percentage of total cases that are suspected.",
+        "columns": ["case_classification"],
     },
     "total_negative_cases": {
-        "function": lambda data: total_negative_cases(data),
+        "function": lambda summary: total_negative_cases(summary),
         "description": "Total number of negative cases in the linelist.",
+        "columns": ["case_classification"],
     },
     "total_negative_cases_percentage": {
-        "function": lambda data: "%.2f"
-        % (total_negative_cases(data) / total_cases(data) * 100),
+        "function": lambda summary: "%.2f"
+        % (total_negative_cases(summary) / total_cases(summary) * 100),
         "description": "Percentage of total cases that are negative.",
+        "columns": ["case_classification"],
     },
     "total_unknown_cases": {
-        "function": lambda data: total_unknown_cases(data),
+        "function": lambda summary: total_unknown_cases(summary),
         "description": "Total number of unknown cases in the linelist.",
+        "columns": ["case_classification"],
     },
     "total_unknown_cases_percentage": {
-        "function": lambda data: "%.2f"
-        % (total_unknown_cases(data) / total_cases(data) * 100),
+        "function": lambda summary: "%.2f"
+        % (total_unknown_cases(summary) / total_cases(summary) * 100),
         "description": "Percentage of total cases that are unknown.",
+        "columns": ["case_classification"],
     },
     "total_health_workers": {
-        "function": lambda data: total_health_workers(data),
+        "function": lambda summary: total_health_workers(summary),
         "description": "Total number of health workers among all cases in the linelist.",
+        "columns": ["health_worker"],
     },
     "total_health_workers_percentage": {
-        "function": lambda data: "%.2f"
-        % (total_health_workers(data) / total_cases(data) * 100),
+        "function": lambda summary: "%.2f"
+        % (total_health_workers(summary) / total_cases(summary) * 100),
         "description": "Percentage of total cases that are health workers.",
+        "columns": ["health_worker"],
     },
     "total_sex_workers": {
-        "function": lambda data: total_sex_workers(data),
+        "function": lambda summary: total_sex_workers(summary),
         "description": "Total number of sex workers among all cases in the linelist.",
+        "columns": ["sex_worker"],
     },
     "total_sex_workers_percentage": {
-        "function": lambda data: "%.2f"
-        % (total_sex_workers(data) / total_cases(data) * 100),
+        "function": lambda summary: "%.2f"
+        % (total_sex_workers(summary) / total_cases(summary) * 100),
         "description": "Percentage of total cases that are sex workers.",
+        "columns": ["sex_worker"],
     },
     "total_male_cases": {
-        "function": lambda data: total_male_cases(data),
+        "function": lambda summary: total_male_cases(summary),
         "description": "Total number of cases (regardless of case classification) in the linelist that are male.",
+        "columns": ["sex_at_birth"],
     },
     "total_male_cases_percentage": {
-        "function": lambda data: "%.2f"
-        % (total_male_cases(data) / total_cases(data) * 100),
+        "function": lambda summary: "%.2f"
+        % (total_male_cases(summary) / total_cases(summary) * 100),
         "description": "Percentage of total cases that are male.",
+        "columns": ["sex_at_birth"],
     },
     "total_female_cases": {
-        "function": lambda data: total_female_cases(data),
+        "function": lambda summary: total_female_cases(summary),
         "description": "Total number of cases (regardless of case classification) in the linelist that are female.",
+        "columns": ["sex_at_birth"],
     },
     "total_female_cases_percentage": {
-        "function": lambda data: "%.2f"
-        % (total_female_cases(data) / total_cases(data) * 100),
+        "function": lambda summary: "%.2f"
+        % (total_female_cases(summary) / total_cases(summary) * 100),
         "description": "Percentage of total cases that are female.",
+        "columns": ["sex_at_birth"],
     },
     "total_median_age": {
-        "function": lambda data: total_median_age(data),
+        "function": lambda summary: total_median_age(summary),
         "description": "Median age of all cases (regardless of case classification) in the linelist.",
+        "columns": ["age_years"],
     },
     "total_lower_quartile_age": {
-        "function": lambda data: total_lower_quartile_age(data),
+        "function": lambda summary: total_lower_quartile_age(summary),
         "description": "Lower quartile age of all cases (regardless of case classification) in the linelist.",
+        "columns": ["age_years"],
     },
     "total_upper_quartile_age": {
-        "function": lambda data: total_upper_quartile_age(data),
+        "function": lambda summary: total_upper_quartile_age(summary),
         "description": "Upper quartile age of all cases (regardless of case classification) in the linelist.",
+        "columns": ["age_years"],
     },
     "earliest_case_date": {
-        "function": lambda data: earliest_case_date(data),
+        "function": lambda summary: earliest_case_date(summary),
         "description": "Date of the earliest case in the linelist.",
+        "columns": ["notification_date"],
     },
 }
 
 
-def find_and_replace(html, data, extra_vars={}) -> str:
-    # regular expression to match variables enclosed in {{ }}
-    pattern = re.compile(r"{{\s*(\w+)\s*}}")
-
-    # initialize a counter for the number of replacements
-    replacements_count = 0
-
-    # function to replace each variable with its computed value
-    def replace_variable(match):
-        nonlocal replacements_count  # ensure we can modify the outer variable
-        variable_name = match.group(1)
-        # check if the variable is extra_vars
-        if variable_name in extra_vars:
-            replacements_count += 1
-            return str(extra_vars[variable_name])
-        # check if the variable is in the VARIABLES dictionary
-        if variable_name in VARIABLES:
-            # compute the value using the associated function
-            value = VARIABLES[variable_name]["function"](data)
-            replacements_count += 1
-            return str(value)
+def compute_variables(summary, variable_names):
+    """
+    Computes the given variables from a summary of a linelist, each variable once, such
+    that all variables share the value counts of the summary (e.g. percentages and
+    the totals they are derived from, or the different quantiles of a column).
+    """
+    return {
+        variable_name: VARIABLES[variable_name]["function"](summary)
+        for variable_name in variable_names
+    }
+
+
+def variable_values(data, variable_names):
+    """
+    Returns the values of the given variables for a linelist (a dataframe, or a summary
+    of a linelist read in chunks). Values are memoized per linelist for the rest of the
+    run, so that populating several HTML strings from the same linelist (e.g. the
+    title, introductory text and text sections of a report) computes each variable
+    only once, and only the variables not computed yet are summarised.
+    """
+    if isinstance(data, pd.DataFrame):
+        values = frame_cache(data, "variables")
+    else:
+        values = data.setdefault("values", {})
+
+    missing_variable_names = set(variable_names) - values.keys()
+    if missing_variable_names:
+        summary = data
+        if isinstance(data, pd.DataFrame):
+            summary = summarise(data, missing_variable_names)
+        values.update(compute_variables(summary, missing_variable_names))
+    return {variable_name: values[variable_name] for variable_name in variable_names}
+
+
+def variable_table(variable_name, group_by, rows):
+    # HTML table of the values of a variable for each group (rows of group values and value)
+    html = "<table><tr>"
+    html += "".join(f"<th>{column}</th>" for column in group_by)
+    html += f"<th>{variable_name}</th></tr>"
+    for group_values, value in rows:
+        html += "<tr>"
+        html += "".join(f"<td>{group_value}</td>" for group_value in group_values)
+        html += f"<td>{value}</td></tr>"
+    html += "</table>"
+    return html
+
+
+def compute_parameterized_variable(cube, variable_name, group_by, scope):
+    """
+    Computes a parameterized variable from a count cube: its value within a scope, or
+    if grouped, an HTML table of its values for each group (observed within the scope,
+    groups with missing values being left out).
+    """
+    if not group_by:
+        return VARIABLES[variable_name]["function"](scope_summary(cube, scope))
+
+    groups = (
+        scope_counts(cube["total"], scope)
+        .groupby(level=list(group_by), observed=True)
+        .sum()
+    )
+    rows = []
+    for group_values in groups[groups > 0].index:
+        if not isinstance(group_values, tuple):
+            group_values = (group_values,)
+        group_scope = scope + tuple(
+            (column, str(value)) for column, value in zip(group_by, group_values)
+        )
+        value = VARIABLES[variable_name]["function"](scope_summary(cube, group_scope))
+        rows.append((group_values, value))
+    return variable_table(variable_name, group_by, rows)
+
+
+def parameterized_values(data, placeholders):
+    """
+    Returns the values of parameterized variables, given as (variable name, group_by,
+    scope) placeholders, for a linelist (a dataframe, or a summary with a count cube
+    over the dimensions referenced by the placeholders, see summarise_chunks). All
+    placeholders are computed from one count cube, and values are memoized per
+    linelist like those of variable_values. Placeholders referencing columns that are
+    not in the linelist (or not in the dimensions of its count cube) are left out,
+    i.e. left unresolved when populating (see replace_placeholders).
+    """
+    if isinstance(data, pd.DataFrame):
+        values = frame_cache(data, "variables")
+        columns = set(data.columns)
+    else:
+        values = data.setdefault("values", {})
+        columns = set(data.get("cube", {}).get("dimensions", ()))
+
+    placeholders = [
+        placeholder
+        for placeholder in placeholders
+        if placeholder_columns(*placeholder[1:]) <= columns
+    ]
+    missing_placeholders = [
+        placeholder
+        for placeholder in placeholders
+        if placeholder_key(*placeholder) not in values
+    ]
+    if missing_placeholders:
+        if isinstance(data, pd.DataFrame):
+            dimensions = set().union(
+                *(
+                    placeholder_columns(group_by, scope)
+                    for _, group_by, scope in missing_placeholders
+                )
+            )
+            variable_names = {
+                variable_name for variable_name, _, _ in missing_placeholders
+            }
+            cube = summarise_cube(data, dimensions, variable_names)
+        else:
+            cube = data["cube"]
+        for placeholder in missing_placeholders:
+            values[placeholder_key(*placeholder)] = compute_parameterized_variable(
+                cube, *placeholder
+            )
+    return {
+        placeholder_key(*placeholder): values[placeholder_key(*placeholder)]
+        for placeholder in placeholders
+    }
+
+
+def template_placeholders(html, extra_vars={}):
+    """
+    Returns the names of the computable variables referenced by placeholders in an
+    HTML string (variables provided by extra_vars are not computed), and the
+    parameterized placeholders as (variable name, group_by, scope) tuples.
+    Placeholders in scripts and data URIs are ignored (see iter_segments).
+    """
+    variable_names, placeholders = set(), set()
+    for match in iter_placeholders([html]):
+        variable_name, parameters = match.groups()
+        if variable_name in extra_vars or variable_name not in VARIABLES:
+            continue
+        if parameters is None:
+            variable_names.add(variable_name)
         else:
-            return f"{{{{ {variable_name} }}}}"  # leave it as is if not found
+            placeholders.add((variable_name, *parse_parameters(parameters)))
+    return variable_names, placeholders
+
+
+def template_dimensions(html, extra_vars={}):
+    """
+    Returns the columns referenced by the parameters of the placeholders in an HTML
+    string, i.e. the dimensions of the count cube needed to compute them.
+    """
+    _, placeholders = template_placeholders(html, extra_vars)
+    return set().union(
+        *(placeholder_columns(group_by, scope) for _, group_by, scope in placeholders)
+    )
+
+
+def template_values(html, data, extra_vars={}):
+    """
+    Computes the variables referenced by placeholders in an HTML string (not provided
+    by extra_vars) for a linelist, all up front (or reusing their values if already
+    computed for this linelist), once however many times they appear in the HTML.
+    Values are keyed by variable name, or by placeholder_key for parameterized
+    variables.
+    """
+    variable_names, placeholders = template_placeholders(html, extra_vars)
+    values = variable_values(data, variable_names)
+    values.update(parameterized_values(data, placeholders))
+    return values
+
+
+def replace_placeholders(segments, values, extra_vars={}, report=None):
+    """
+    Replaces the placeholders in the segments of an HTML document (see iter_segments)
+    with their values (see template_values) or extra_vars, yielding the populated text.
+    The number of replacements and the placeholders left unresolved, with their
+    position (line, column) in the document, are recorded in report (if given).
+    """
+    if report is None:
+        report = {}
+    report["replacements_count"] = 0
+    report["unresolved"] = []
+
+    line, column = 1, 1
+    for text, match in segments:
+        populated_text = text
+        if match is not None:
+            variable_name, parameters = match.groups()
+            # parameterized variable, left as is unless it was computed (e.g. not
+            # if it references columns missing from the linelist)
+            if parameters is not None:
+                key = placeholder_key(variable_name, *parse_parameters(parameters))
+                if (
+                    variable_name in extra_vars
+                    or variable_name not in VARIABLES
+                    or key not in values
+                ):
+                    report["unresolved"].append((text, line, column))
+                else:
+                    report["replacements_count"] += 1
+                    populated_text = str(values[key])
+            # check if the variable is extra_vars
+            elif variable_name in extra_vars:
+                report["replacements_count"] += 1
+                populated_text = str(extra_vars[variable_name])
+            # check if the variable is in the VARIABLES dictionary
+            elif variable_name in VARIABLES:
+                # use the value computed up front
+                report["replacements_count"] += 1
+                populated_text = str(values[variable_name])
+            else:
+                # leave it as is if not found
+                report["unresolved"].append((text, line, column))
+                populated_text = f"{{{{ {variable_name} }}}}"
+        yield populated_text
+
+        # keep track of the position in the (unpopulated) document
+        newlines_count = text.count("\n")
+        if newlines_count > 0:
+            line += newlines_count
+            column = len(text) - text.rfind("\n")
+        else:
+            column += len(text)
+
+
+def populate_file(in_file, out_file, values, extra_vars={}, segments=None):
+    """
+    Populates the placeholders of an HTML file with their values (see template_values)
+    or extra_vars, streaming the populated HTML to out_file without reading the whole
+    file in memory, unless the segments of the file were compiled beforehand (see
+    iter_segments), e.g. to populate the same file many times. Returns the report of
+    replace_placeholders.
+    """
+    if segments is None:
+        segments = iter_segments(read_chunks(in_file))
+    report = {}
+    with open(out_file, "w", encoding="utf-8") as f:
+        f.writelines(replace_placeholders(segments, values, extra_vars, report))
+    return report
+
+
+def find_and_replace(html, data, extra_vars={}) -> str:
+    # compute the variables used in the HTML up front
+    values = template_values(html, data, extra_vars)
 
     # populate all variables in the HTML with computed values
-    updated_html = pattern.sub(replace_variable, html)
+    report = {}
+    updated_html = "".join(
+        replace_placeholders(iter_segments([html]), values, extra_vars, report)
+    )
 
-    return updated_html, replacements_count
+    return updated_html, report["replacements_count"]
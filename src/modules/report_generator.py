@@ -1,38 +1,132 @@
+import copy
+import shutil
+import tempfile
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
 from jinja2 import Environment, FileSystemLoader
-from plotting_modules.time_series_barplot import (
-    preprocess as time_series_barplot_preprocess,
-    plot as time_series_barplot_plot,
+from plotly.offline import get_plotlyjs_version
+from modules.aggregation import build_cube, combine_counts
+from modules.data_filtering import apply_filters, frame_cache
+from modules.bitmap_index import build_indexes
+from modules.column_planner import aggregate_columns, report_texts, section_columns
+from modules.plot_registry import PLOT_TYPES
+from modules.section_cache import (
+    copy_exports,
+    section_key,
+    read_cached_section,
+    render_cached_section,
 )
-from plotting_modules.spatial_map import (
-    preprocess as spatial_map_preprocess,
-    plot as spatial_map_plot,
-)
-from plotting_modules.age_sex_pyramid import (
-    preprocess as age_sex_pyramid_preprocess,
-    plot as age_sex_pyramid_plot,
+from modules.populate_variables import (
+    combine_summaries,
+    find_and_replace,
+    summarise,
+    template_values,
 )
 from datetime import datetime
 
 REPORT_ROOT_FOLDER = Path(__file__).parent.parent
 
-PLOT_TYPES = {
-    "time-series-barplot": {
-        "preprocess": time_series_barplot_preprocess,
-        "plot": time_series_barplot_plot,
-    },
-    "spatial-map": {
-        "preprocess": spatial_map_preprocess,
-        "plot": spatial_map_plot,
-    },
-    "age-sex-pyramid": {
-        "preprocess": age_sex_pyramid_preprocess,
-        "plot": age_sex_pyramid_plot,
-    },
-}
-
-
-def create_section(data, section, in_dir, out_dir):
+# plotly.js bundled with the installed plotly, i.e. matching the figures it generates
+# (see plotting_modules.group_figure for typed arrays)
+PLOTLY_SCRIPT = '<script src="https://cdn.plot.ly/plotly-%s.min.js"></script>' % (
+    get_plotlyjs_version()
+)
+
+
+# plot sections only aggregate a count cube if it has at most this fraction of the
+# rows of the linelist, otherwise they aggregate the rows of the linelist
+MAX_CUBE_RATIO = 0.5
+
+
+def section_frames(data, sections):
+    """
+    Returns the dataframe each plot section (None for other sections) filters and
+    aggregates: the count cube (see build_cube) over the columns used by the section
+    (including by its filters), shared by the sections using the same columns, or the
+    linelist itself if the cube is not much smaller (see MAX_CUBE_RATIO). Indexes
+    built on the linelist (see modules.bitmap_index) are built again on each cube, so
+    that section filters use them either way.
+    """
+    indexes = frame_cache(data, "indexes") if data is not None else {}
+    frames, cubes = [], {}
+    for section in sections:
+        if section["type"] not in PLOT_TYPES:
+            frames.append(None)
+            continue
+        columns = frozenset(
+            column for column in section_columns(section) if column in data.columns
+        )
+        if columns not in cubes:
+            cube = build_cube(data, columns) if columns else data
+            if len(cube) > MAX_CUBE_RATIO * len(data):
+                cube = data
+            elif cube is not data:
+                build_indexes(cube, [column for column in indexes if column in columns])
+            cubes[columns] = cube
+        frames.append(cubes[columns])
+    return frames
+
+
+def aggregate_sections(
+    data_chunks, sections, filtering_config=None, variable_names=None, dimensions=None
+):
+    """
+    Aggregates a linelist read in chunks into the counts needed by each plot section
+    (None for other sections), applying global filters to each chunk, so that only
+    the aggregated counts are kept in memory. If variable_names is given, the filtered
+    linelist is also summarised for these variables in the same pass (see summarise),
+    otherwise the returned summary is None.
+    """
+    sections_counts = [None] * len(sections)
+    summary = None
+    # columns used once global filters are applied
+    columns = aggregate_columns(sections, variable_names, dimensions)
+    for data_chunk in data_chunks:
+        # apply global filters
+        filtered_chunk = apply_filters(data_chunk, filtering_config, columns)
+        # count cubes of the plot sections
+        chunk_frames = section_frames(filtered_chunk, sections)
+        for index, section in enumerate(sections):
+            if section["type"] in PLOT_TYPES:
+                aggregate = PLOT_TYPES[section["type"]]["aggregate"]
+                sections_counts[index] = combine_counts(
+                    sections_counts[index], aggregate(chunk_frames[index], section)
+                )
+        if variable_names is not None:
+            summary = combine_summaries(
+                summary, summarise(filtered_chunk, variable_names, dimensions)
+            )
+    return sections_counts, summary
+
+
+def populate_report_texts(config, data, extra_vars={}):
+    """
+    Returns a copy of a report config where variable placeholders in the title,
+    introductory text and text/bullet-points sections are populated from a linelist
+    (a dataframe, or a summary of a linelist read in chunks) and extra_vars.
+    """
+    # compute the variables of all texts at once, reused when populating each text
+    template_values(" ".join(report_texts(config)), data, extra_vars)
+
+    def populate(text):
+        return find_and_replace(str(text), data, extra_vars)[0]
+
+    config = dict(config)
+    for key in ["report_title", "introductory_text"]:
+        if config.get(key) is not None:
+            config[key] = populate(config[key])
+    config["sections"] = [dict(section) for section in config.get("sections", [])]
+    for section in config["sections"]:
+        if section.get("type") == "text" and section.get("content") is not None:
+            section["content"] = populate(section["content"])
+        elif section.get("type") == "bullet-points":
+            section["content"] = [
+                populate(point) for point in section.get("content") or []
+            ]
+    return config
+
+
+def create_section(data, section, in_dir, out_dir, counts=None):
     # extract section type
     section_type = section["type"]
 
@@ -67,9 +161,10 @@ def create_section(data, section, in_dir, out_dir):
 
     # plot
     elif section_type in PLOT_TYPES:
-        # preprocess the data
-        preprocess = PLOT_TYPES[section_type]["preprocess"]
-        plot_data = preprocess(data, section)
+        # preprocess the data (unless already aggregated)
+        if counts is None:
+            counts = PLOT_TYPES[section_type]["aggregate"](data, section)
+        plot_data = PLOT_TYPES[section_type]["finalize"](counts, section)
         # generate the plot
         plotting_config = section.get("plotting")
         # look for any parameter in the plotting config that ends in 'file'
@@ -95,7 +190,142 @@ def create_section(data, section, in_dir, out_dir):
     return html
 
 
-def generate_report_html(data, config, in_dir, out_dir):
+def create_cached_section(data, section, in_dir, out_dir, counts=None, cache_dir=None):
+    """
+    Creates the HTML component of a section, reusing the HTML (and exported files) of
+    a plot section from the section cache in cache_dir (if any) when neither its
+    config, the counts aggregated for it nor the files it references have changed.
+    """
+    if cache_dir is None or section["type"] not in PLOT_TYPES:
+        return create_section(data, section, in_dir, out_dir, counts)
+
+    if counts is None:
+        counts = PLOT_TYPES[section["type"]]["aggregate"](data, section)
+    key = section_key(section, counts, in_dir)
+    html = read_cached_section(cache_dir, key, out_dir)
+    if html is None:
+        html = render_cached_section(
+            cache_dir,
+            key,
+            out_dir,
+            lambda export_dir: create_section(
+                None, copy.deepcopy(section), in_dir, export_dir, counts
+            ),
+        )
+    return html
+
+
+def create_sections_in_parallel(
+    sections_data, sections, in_dir, out_dir, sections_counts, workers, cache_dir=None
+):
+    """
+    Yields the HTML component of each section (in order), given the dataframe each
+    section aggregates (see section_frames) or its counts, plot sections being
+    aggregated first and then finalized and plotted by a pool of worker processes,
+    which are only passed the aggregated counts of their section. Each worker exports
+    files to a temporary directory of its own, and exported files are moved to out_dir
+    (see copy_exports) as sections are yielded, so that sections with the same
+    filestem never overwrite each other's files. The HTML of a section is released
+    once yielded.
+    """
+    with (
+        tempfile.TemporaryDirectory() as exports_dir,
+        ProcessPoolExecutor(max_workers=workers) as executor,
+    ):
+        futures = []
+        for index, (section_data, section, counts) in enumerate(
+            zip(sections_data, sections, sections_counts)
+        ):
+            if section["type"] in PLOT_TYPES:
+                if counts is None:
+                    counts = PLOT_TYPES[section["type"]]["aggregate"](
+                        section_data, section
+                    )
+                export_dir = Path(exports_dir) / str(index)
+                export_dir.mkdir()
+                futures.append(
+                    executor.submit(
+                        create_cached_section,
+                        None,
+                        section,
+                        in_dir,
+                        str(export_dir),
+                        counts,
+                        cache_dir,
+                    )
+                )
+            else:
+                futures.append(None)
+        for index, section in enumerate(sections):
+            future, futures[index] = futures[index], None
+            if future is not None:
+                html = future.result()
+                export_dir = Path(exports_dir) / str(index)
+                copy_exports(export_dir, out_dir)
+                shutil.rmtree(export_dir)
+                yield html
+            else:
+                yield create_section(sections_data[index], section, in_dir, out_dir)
+
+
+def create_sections(
+    sections_data, sections, in_dir, out_dir, sections_counts, cache_dir=None
+):
+    """
+    Yields the HTML component of each section (in order), given the dataframe each
+    section aggregates (see section_frames) or its counts, each section being created
+    only once the previous one has been consumed (e.g. written to the report file).
+    """
+    for section_data, section, counts in zip(sections_data, sections, sections_counts):
+        yield create_cached_section(
+            section_data, section, in_dir, out_dir, counts, cache_dir
+        )
+
+
+def report_stream(
+    data,
+    config,
+    in_dir,
+    out_dir,
+    sections_counts=None,
+    variables_data=None,
+    extra_vars={},
+    workers=None,
+    section_cache_dir=None,
+):
+    """
+    Returns the report rendered from its HTML template as a stream of HTML fragments
+    (see jinja2.Template.stream), where each section is created when the template
+    reaches it, so that the whole report is never held in memory at once.
+    """
+    # sections_counts holds pre-aggregated counts for plot sections, if any,
+    # otherwise plot sections are aggregated from count cubes of the linelist
+    sections = config.get("sections", [])
+    if sections_counts is None:
+        sections_counts = [None] * len(sections)
+        sections_data = section_frames(data, sections)
+    else:
+        sections_data = [data] * len(sections)
+
+    # populate variables in the report texts (if variables_data, i.e. the linelist
+    # or a summary of it, is given), including the variables computed from the counts
+    # of plot sections (e.g. rolling statistics), aggregated up front
+    if variables_data is not None:
+        sections_counts = list(sections_counts)
+        for index, section in enumerate(sections):
+            plot_type = PLOT_TYPES.get(section["type"])
+            if plot_type is None or "variables" not in plot_type:
+                continue
+            if sections_counts[index] is None:
+                sections_counts[index] = plot_type["aggregate"](
+                    sections_data[index], section
+                )
+            extra_vars = {
+                **extra_vars,
+                **plot_type["variables"](sections_counts[index], section),
+            }
+        config = populate_report_texts(config, variables_data, extra_vars)
+
     # extract report parameters
     report_title = config.get("report_title", "Analysis Report")
     introductory_text = config.get("introductory_text", "")
@@ -103,11 +333,21 @@ def generate_report_html(data, config, in_dir, out_dir):
     sections = config.get("sections", [])
     html_template = config.get("html_template")
 
-    # HTML component for each section
-    sections_html = []
-    for section in sections:
-        section_html = create_section(data, section, in_dir, out_dir)
-        sections_html.append(section_html)
+    # HTML component for each section, created lazily
+    if workers is not None and workers > 1:
+        sections_html = create_sections_in_parallel(
+            sections_data,
+            sections,
+            in_dir,
+            out_dir,
+            sections_counts,
+            workers,
+            section_cache_dir,
+        )
+    else:
+        sections_html = create_sections(
+            sections_data, sections, in_dir, out_dir, sections_counts, section_cache_dir
+        )
 
     # set up Jinja2 template environment
     templates_folder = REPORT_ROOT_FOLDER / "templates"
@@ -116,13 +356,28 @@ def generate_report_html(data, config, in_dir, out_dir):
     # load template file
     template = env.get_template(html_template)
 
-    # render HTML report
-    report_html = template.render(
+    # render HTML report (as a stream)
+    return template.stream(
         report_title=report_title,
         introductory_text=introductory_text,
         report_date=report_date,
-        plotly_script='<script src="https://cdn.plot.ly/plotly-latest.min.js"></script>',
+        plotly_script=PLOTLY_SCRIPT,
         sections_html=sections_html,
     )
 
-    return report_html
+
+def generate_report_html(data, config, in_dir, out_dir, *args, **kwargs):
+    """
+    Returns the report rendered from its HTML template as a string (see report_stream
+    for the arguments).
+    """
+    return "".join(report_stream(data, config, in_dir, out_dir, *args, **kwargs))
+
+
+def write_report_html(output_file, data, config, in_dir, out_dir, *args, **kwargs):
+    """
+    Renders the report from its HTML template straight to output_file, section by
+    section (see report_stream for the arguments).
+    """
+    with open(output_file, "w", encoding="utf-8") as f:
+        report_stream(data, config, in_dir, out_dir, *args, **kwargs).dump(f)
@@ -0,0 +1,359 @@
+import os
+import json
+import pickle
+import hashlib
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+from modules.aggregation import combine_counts, subtract_counts
+from modules.column_planner import aggregate_columns
+from modules.data_filtering import filter_mask
+from modules.populate_variables import combine_summaries, subtract_summaries, summarise
+from modules.plot_registry import PLOT_TYPES
+from modules.report_generator import aggregate_sections
+
+# bump to invalidate report states when the way they are aggregated changes
+REPORT_STATE_VERSION = 4
+
+# column identifying the records of a linelist exported from InsightBoard
+RECORD_ID_COLUMN = "record_id"
+# column of the records kept in a report state holding a hash of each record
+RECORD_HASH_COLUMN = "__hash__"
+# column of the records kept in a report state holding the key of each record, i.e. the
+# position of the values of its key columns (the columns the aggregates are computed
+# from, see aggregate_columns) in the distinct values kept in the state, or -1 for
+# records not passing the global filters
+RECORD_KEY_COLUMN = "__key__"
+
+
+def state_key(config, columns, variable_names=None, dimensions=None):
+    """
+    Returns a hash of everything the aggregates kept in a report state depend on, i.e.
+    the global filters, the plot sections (except their plotting parameters), the
+    linelist schema, the columns read and the variables (and dimensions) summarised.
+    """
+    sections = [
+        {key: value for key, value in section.items() if key != "plotting"}
+        for section in config.get("reporting", {}).get("sections", [])
+        if section["type"] in PLOT_TYPES
+    ]
+    key = [
+        REPORT_STATE_VERSION,
+        config.get("filtering"),
+        sections,
+        config.get("linelist_schema"),
+        sorted(columns),
+        sorted(variable_names) if variable_names is not None else None,
+        sorted(dimensions) if dimensions is not None else None,
+    ]
+    return hashlib.sha256(
+        json.dumps(key, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+def load_state(state_file, key):
+    """
+    Loads the report state saved in state_file, or returns a new (empty) state if there
+    is none or if it was aggregated for a different key (see state_key).
+    """
+    if Path(state_file).exists():
+        with open(state_file, "rb") as f:
+            state = pickle.load(f)
+        if state.get("key") == key:
+            return state
+    return {
+        "key": key,
+        "records": None,
+        "keys": None,
+        "sections_counts": None,
+        "summary": None,
+    }
+
+
+def save_state(state, state_file):
+    """
+    Saves a report state to state_file.
+    """
+    Path(state_file).parent.mkdir(exist_ok=True, parents=True)
+    # write to a temporary file first so that an interrupted run never leaves a
+    # partial state behind
+    tmp_file = Path(state_file).with_suffix(".%d.tmp" % os.getpid())
+    with open(tmp_file, "wb") as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_file, state_file)
+
+
+def record_keys(records, columns):
+    """
+    Returns a hash of the values of the key columns (those that are in the linelist) of
+    each record, and the distinct values of these columns indexed by hash.
+    """
+    values = records[[column for column in columns if column in records.columns]]
+    if values.columns.empty:
+        keys = np.zeros(len(records), dtype=np.uint64)
+    else:
+        keys = pd.util.hash_pandas_object(values, index=False).to_numpy()
+    values = values.set_axis(pd.Index(keys))
+    return keys, values[~values.index.duplicated()]
+
+
+def merge_frames(frame, others):
+    # append frames (e.g. records or distinct key values) to a frame (None if there is
+    # none yet), keeping the last row of each index value and categorical columns
+    # categorical even if their categories differ
+    merged_frame = pd.concat(([frame] if frame is not None else []) + others)
+    merged_frame = merged_frame[~merged_frame.index.duplicated(keep="last")]
+    for column in merged_frame.columns:
+        if any(
+            isinstance(other[column].dtype, pd.CategoricalDtype)
+            for other in others
+            if column in other.columns
+        ) and not isinstance(merged_frame[column].dtype, pd.CategoricalDtype):
+            merged_frame[column] = merged_frame[column].astype("category")
+    return merged_frame
+
+
+class StateUpdate:
+    """
+    The records folded into a report state during a run, collected for each chunk of
+    the linelist and merged into the state once at the end of the run (see merge), so
+    that a run scales with the records folded in rather than with the chunks times
+    the records already kept in the state.
+    """
+
+    def __init__(self, state, columns):
+        self.state = state
+        self.columns = columns
+        # records (and distinct key values) folded in during the run, by chunk
+        self.records = []
+        self.record_ids = set()
+        self.keys = []
+        # position of each distinct key value (by hash), built when first needed
+        self.key_codes = None
+        self.keys_count = 0
+
+    def previous_records(self, record_ids):
+        """
+        Returns the previous version of the given records (if any), i.e. the version
+        folded in earlier in the run, or otherwise the one kept in the state, as a
+        mask of known records and their previous version.
+        """
+        known = np.zeros(len(record_ids), dtype=bool)
+        previous = pd.DataFrame()
+        # records folded in earlier in the run (e.g. a record updated in a later chunk
+        # of the same linelist), merged only when there are any
+        in_run = np.fromiter(
+            (record_id in self.record_ids for record_id in record_ids),
+            dtype=bool,
+            count=len(record_ids),
+        )
+        sources = [self.state["records"]]
+        if in_run.any():
+            self.records = [merge_frames(None, self.records)]
+            sources.append(self.records[0])
+        for records in sources:
+            if records is None:
+                continue
+            positions = records.index.get_indexer(record_ids)
+            found = positions >= 0
+            if found.any():
+                rows = records.iloc[positions[found]]
+                previous = rows if previous.empty else merge_frames(previous, [rows])
+                known |= found
+        return known, previous.reindex(record_ids[known]) if known.any() else previous
+
+    def encode(self, records):
+        """
+        Returns the key of each of the given records, adding the values of their key
+        columns that are not kept in the state yet.
+        """
+        hashes, values = record_keys(records, self.columns)
+        if self.key_codes is None:
+            stored = self.state["keys"]
+            self.keys_count = len(stored) if stored is not None else 0
+            self.key_codes = (
+                dict(
+                    zip(
+                        record_keys(stored, self.columns)[0].tolist(),
+                        range(len(stored)),
+                    )
+                )
+                if stored is not None
+                else {}
+            )
+        new = np.fromiter(
+            (key not in self.key_codes for key in values.index.tolist()),
+            dtype=bool,
+            count=len(values),
+        )
+        if new.any():
+            values = values[new]
+            codes = range(self.keys_count, self.keys_count + len(values))
+            self.key_codes.update(zip(values.index.tolist(), codes))
+            self.keys.append(values.set_axis(pd.Index(codes)))
+            self.keys_count += len(values)
+        return np.fromiter(
+            (self.key_codes[key] for key in hashes.tolist()),
+            dtype=np.int32,
+            count=len(hashes),
+        )
+
+    def decode(self, keys):
+        """
+        Returns the values of the key columns (see aggregate_columns) for the given
+        keys, one row per key.
+        """
+        values = self.state["keys"]
+        if values is None or keys.max() >= len(values):
+            # keys of records folded in earlier in the run
+            values = self.state["keys"] = merge_frames(values, self.keys)
+            self.keys = []
+        return values.iloc[keys].reset_index(drop=True)
+
+    def add(self, records, kept):
+        """
+        Adds the (latest version of) records folded in, with the mask of the records
+        passing the global filters. The state keeps the hash and key of each record
+        rather than the record itself.
+        """
+        keys = np.full(len(records), -1, dtype=np.int32)
+        keys[kept] = self.encode(records[kept])
+        self.records.append(
+            pd.DataFrame(
+                {
+                    RECORD_HASH_COLUMN: records[RECORD_HASH_COLUMN],
+                    RECORD_KEY_COLUMN: keys,
+                },
+                index=records.index,
+            )
+        )
+        self.record_ids.update(records.index)
+
+    def removed_frame(self, previous):
+        """
+        Returns the values of the key columns of the previous version of records (as
+        kept in the state) that passed the global filters, from which their aggregates
+        can be subtracted (None if there are none).
+        """
+        if previous.empty:
+            return None
+        keys = previous[RECORD_KEY_COLUMN].to_numpy()
+        keys = keys[keys >= 0]
+        return self.decode(keys) if len(keys) > 0 else None
+
+    def merge(self):
+        """
+        Merges the records (and distinct key values) folded in during the run into the
+        state.
+        """
+        if self.records:
+            self.state["records"] = merge_frames(self.state["records"], self.records)
+        if self.keys:
+            self.state["keys"] = merge_frames(self.state["keys"], self.keys)
+        self.records, self.record_ids, self.keys = [], set(), []
+
+
+def record_changes(update, data_chunk):
+    """
+    Compares a chunk of a linelist with the records folded into a report state (see
+    StateUpdate), returning the records of the chunk that are new or were updated
+    (with their hash) and the previous version of the updated ones (as kept in the
+    state).
+    """
+    if RECORD_ID_COLUMN not in data_chunk.columns:
+        raise ValueError(f"Column '{RECORD_ID_COLUMN}' not found in data.")
+    if data_chunk[RECORD_ID_COLUMN].isna().any():
+        raise ValueError(f"Missing values found in column '{RECORD_ID_COLUMN}'.")
+
+    # the last occurrence of a record is its latest version
+    data_chunk = data_chunk.drop_duplicates(RECORD_ID_COLUMN, keep="last").set_index(
+        RECORD_ID_COLUMN
+    )
+    data_chunk[RECORD_HASH_COLUMN] = pd.util.hash_pandas_object(data_chunk, index=False)
+
+    known, previous = update.previous_records(data_chunk.index)
+    changed = ~known
+    if known.any():
+        changed[known] = (
+            previous[RECORD_HASH_COLUMN].to_numpy()
+            != data_chunk[RECORD_HASH_COLUMN].to_numpy()[known]
+        )
+        previous = previous[changed[known]]
+    return data_chunk[changed], previous
+
+
+def update_state(
+    state,
+    data_chunks,
+    sections,
+    filtering_config=None,
+    variable_names=None,
+    dimensions=None,
+):
+    """
+    Folds the records of a linelist read in chunks (e.g. a full export or only the
+    records appended since the last run) that are new or were updated since the last
+    run into the aggregates kept in a report state, i.e. the counts aggregated for each
+    plot section and the summary of the variables (see aggregate_sections). Previous
+    versions of updated records are subtracted from the aggregates, and records that
+    are no longer in the linelist are kept (the linelist being append-only). The state
+    only keeps the id and hash of each record, and its key, i.e. the position of the
+    values of the columns the aggregates are computed from (see aggregate_columns) in
+    the distinct values kept in the state, from which the aggregates of its previous
+    version can be subtracted. Returns the updated counts and summary, and the number
+    of records folded in.
+    """
+    if state["sections_counts"] is None:
+        state["sections_counts"] = [None] * len(sections)
+    update = StateUpdate(
+        state, sorted(aggregate_columns(sections, variable_names, dimensions))
+    )
+    records_count = 0
+    for data_chunk in data_chunks:
+        added_records, removed_records = record_changes(update, data_chunk)
+        if added_records.empty:
+            continue
+
+        # aggregate the records passing the global filters
+        kept = filter_mask(added_records, filtering_config)
+        added_counts, added_summary = aggregate_sections(
+            [added_records.loc[kept, added_records.columns.isin(update.columns)]],
+            sections,
+            None,
+            variable_names,
+            dimensions,
+        )
+        removed_frame = update.removed_frame(removed_records)
+        update.add(added_records, kept)
+
+        state["sections_counts"] = [
+            (
+                subtract_counts(
+                    combine_counts(counts, added),
+                    (
+                        PLOT_TYPES[section["type"]]["aggregate"](removed_frame, section)
+                        if removed_frame is not None
+                        else None
+                    ),
+                )
+                if section["type"] in PLOT_TYPES
+                else None
+            )
+            for section, counts, added in zip(
+                sections, state["sections_counts"], added_counts
+            )
+        ]
+        if variable_names is not None:
+            state["summary"] = subtract_summaries(
+                combine_summaries(state["summary"], added_summary),
+                (
+                    summarise(removed_frame, variable_names, dimensions)
+                    if removed_frame is not None
+                    else None
+                ),
+            )
+        records_count += len(added_records)
+
+    update.merge()
+    return state["sections_counts"], state["summary"], records_count
@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+
+# statistics computed over the trailing window of each date (or period), for each group
+STATISTICS = ["sum", "mean", "ewma", "growth_rate", "doubling_time"]
+
+
+def rolling_statistics(matrix, config):
+    """
+    Computes rolling statistics over a dense matrix of counts (one row per date, or
+    period, in order and one column per group), all groups at once. config maps the
+    name of each statistic to its parameters: statistic (see STATISTICS), window (in
+    dates or periods, 7 by default) and, for ewma, span (window by default), e.g.
+    {'cases_14d': {'statistic': 'sum', 'window': 14}}. Returns a matrix of values (of
+    the same shape as the counts) for each statistic:
+    - sum/mean: sum/mean of the counts over the trailing window
+    - ewma: exponentially weighted moving average of the counts
+    - growth_rate: relative change of the sum over the trailing window since the
+      previous window (e.g. week-on-week growth with daily counts and a window of 7)
+    - doubling_time: number of dates (or periods) for counts to double at the growth
+      rate of the trailing window, only while counts are growing
+    Values that cannot be computed (e.g. growth rates before two full windows) are NaN.
+    """
+    counts = pd.DataFrame(matrix)
+    # trailing sums, by window and by whether partial windows are summed
+    trailing_sums = {}
+
+    def trailing_sum(window, partial=True):
+        if (window, partial) not in trailing_sums:
+            trailing_sums[(window, partial)] = counts.rolling(
+                window=window, min_periods=1 if partial else window
+            ).sum()
+        return trailing_sums[(window, partial)]
+
+    statistics = {}
+    for name, statistic_config in config.items():
+        statistic = statistic_config.get("statistic")
+        window = statistic_config.get("window", 7)
+
+        if statistic == "sum":
+            values = trailing_sum(window)
+        elif statistic == "mean":
+            values = counts.rolling(window=window, min_periods=1).mean()
+        elif statistic == "ewma":
+            values = counts.ewm(span=statistic_config.get("span", window)).mean()
+        elif statistic in ["growth_rate", "doubling_time"]:
+            current_sum = trailing_sum(window, partial=False)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                ratio = (current_sum / current_sum.shift(window)).to_numpy()
+                ratio[~np.isfinite(ratio)] = np.nan
+                if statistic == "growth_rate":
+                    values = ratio - 1
+                else:
+                    values = np.where(
+                        ratio > 1, window * np.log(2) / np.log(ratio), np.nan
+                    )
+        else:
+            raise ValueError(
+                f"Unknown rolling statistic '{statistic}', expected one of {STATISTICS}."
+            )
+        statistics[name] = np.asarray(values, dtype=float)
+    return statistics
@@ -0,0 +1,115 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+from pathlib import Path
+
+# bump to invalidate cached sections when the way sections are rendered changes
+SECTION_CACHE_VERSION = 4
+
+
+def file_fingerprint(path):
+    """
+    Returns a fingerprint (path, size and modification time) of a file referenced by
+    a section, or of every file in it if it is a directory (e.g. a shapefile folder).
+    """
+    path = Path(path)
+    if path.is_dir():
+        return [
+            file_fingerprint(file_path)
+            for file_path in sorted(path.rglob("*"))
+            if file_path.is_file()
+        ]
+    if not path.exists():
+        return [str(path), None]
+    stat = path.stat()
+    return [str(path.resolve()), stat.st_size, stat.st_mtime_ns]
+
+
+def section_key(section, counts, in_dir):
+    """
+    Returns the key of a plot section in the section cache, i.e. a hash of its config,
+    of the counts aggregated for it (which is all the data it plots) and of the files
+    referenced by its plotting config (e.g. shapefiles).
+    """
+    plotting_config = section.get("plotting") or {}
+    files = {
+        key: file_fingerprint(Path(in_dir) / value)
+        for key, value in plotting_config.items()
+        if key.endswith("file") and value is not None
+    }
+    counts_text = counts.to_csv() + str(list(counts.index.names))
+    return hashlib.sha256(
+        json.dumps(
+            [SECTION_CACHE_VERSION, section, counts_text, files],
+            sort_keys=True,
+            default=str,
+        ).encode("utf-8")
+    ).hexdigest()
+
+
+def export_path(out_dir, filename):
+    """
+    Returns the path a file exported by a section is written to in out_dir, i.e.
+    out_dir/filename or, if taken (e.g. by another section with the same filestem),
+    the first of out_dir/<stem>.1<suffix>, out_dir/<stem>.2<suffix>, ... that is
+    free, as named by the plot modules when exporting straight to out_dir.
+    """
+    path = Path(out_dir) / filename
+    counter = 0
+    while path.exists():
+        counter += 1
+        path = Path(out_dir) / f"{Path(filename).stem}.{counter}{Path(filename).suffix}"
+    return path
+
+
+def copy_exports(from_dir, to_dir):
+    # copy the files exported by a section (e.g. PDF plots) from one directory to
+    # another, in the order they were exported, without overwriting existing files
+    file_paths = [path for path in Path(from_dir).iterdir() if path.is_file()]
+    for file_path in sorted(
+        file_paths, key=lambda path: (path.stat().st_mtime_ns, path.name)
+    ):
+        shutil.copy2(file_path, export_path(to_dir, file_path.name))
+
+
+def read_cached_section(cache_dir, key, out_dir):
+    """
+    Returns the HTML of a section from the section cache (restoring its exported files
+    in out_dir), or None if the section is not in the cache.
+    """
+    entry_dir = Path(cache_dir) / key
+    html_file = entry_dir / "section.html"
+    if not html_file.exists():
+        return None
+    copy_exports(entry_dir / "exports", out_dir)
+    return html_file.read_text(encoding="utf-8")
+
+
+def render_cached_section(cache_dir, key, out_dir, render):
+    """
+    Renders a section with render(export_dir), which returns the HTML of the section
+    and writes any exported file in export_dir, and stores both in the section cache
+    before copying the exported files to out_dir. Returns the HTML of the section.
+    """
+    Path(cache_dir).mkdir(parents=True, exist_ok=True)
+    entry_dir = Path(cache_dir) / key
+    # write the entry to a temporary directory first, so that an interrupted run
+    # never leaves a partial entry behind
+    tmp_dir = Path(tempfile.mkdtemp(dir=cache_dir, prefix=f"{key}."))
+    try:
+        export_dir = tmp_dir / "exports"
+        export_dir.mkdir()
+        html = render(str(export_dir))
+        (tmp_dir / "section.html").write_text(html, encoding="utf-8")
+        copy_exports(export_dir, out_dir)
+        try:
+            os.replace(tmp_dir, entry_dir)
+        except OSError:
+            # already stored, e.g. by another worker rendering an identical section
+            pass
+    finally:
+        if tmp_dir.exists():
+            shutil.rmtree(tmp_dir)
+    return html
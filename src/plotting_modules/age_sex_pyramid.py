@@ -2,13 +2,17 @@ import os
 import pandas as pd
 import plotly.graph_objects as go
 
-from modules.data_filtering import apply_filters
+from modules.aggregation import count_rows
+from modules.data_filtering import select_rows
 from plotting_modules.add_tabs import generate_tabbed_html
+from plotting_modules.group_figure import figure_html, group_figure
+from plotting_modules.group_slices import iter_groups
 
 
-def preprocess(data, config):
+def aggregate(data, config):
     """
-    Preprocesses data for pyramid plot.
+    Aggregates data for pyramid plot into counts by group, age group and sex.
+    Counts aggregated from different chunks of data can be combined with combine_counts.
     """
     filtering_config = config.get("filtering", [])
     age_column = config.get("age_column", "age")
@@ -18,14 +22,11 @@ def preprocess(data, config):
     sex_column = config.get("sex_column", "sex")
     group_by = config.get("group_by", None)
 
-    # apply filters
-    filtered_data = apply_filters(data, filtering_config)
-    # return empty dataframe if no data left after filtering
-    if filtered_data.empty:
-        return pd.DataFrame()
-
-    # create a copy of relevant column
-    plot_data = filtered_data.copy()
+    # apply filters (selecting rows into a new dataframe that can be modified)
+    plot_data = select_rows(data, filtering_config)
+    # return empty counts if no data left after filtering
+    if plot_data.empty:
+        return pd.Series(dtype="int64")
 
     # check that age_column is in data
     if age_column not in plot_data.columns:
@@ -43,7 +44,7 @@ def preprocess(data, config):
         plot_data.rename(columns={group_by: "group"}, inplace=True)
 
     # add inf to the last age group
-    age_groups.append(float("inf"))
+    age_groups = age_groups + [float("inf")]
 
     # take only rows with sex_column matching "male" and "female"
     plot_data = plot_data[plot_data[sex_column].isin(["male", "female"])]
@@ -53,14 +54,43 @@ def preprocess(data, config):
         lambda x: 0 if pd.isnull(x) else int(x)
     )
     plot_data["age_group"] = pd.cut(plot_data[age_column], bins=age_groups, right=False)
-    # group by age and sex
-    plot_data = (
-        plot_data.groupby(["group", "age_group", sex_column], observed=False)
-        .size()
-        .unstack(sex_column, fill_value=0)
-        .reset_index()
+
+    # count only observed combinations, the missing ones are filled in by finalize
+    return count_rows(plot_data, ["group", "age_group", sex_column])
+
+
+def finalize(counts, config):
+    """
+    Turns the counts aggregated for pyramid plot into plot data.
+    """
+    age_groups = config.get(
+        "age_groups", [0, 5, 10, 15, 20, 25, 30, 35, 40, 45, 50, 55, 60]
+    )
+    sex_column = config.get("sex_column", "sex")
+
+    # return empty dataframe if nothing was counted
+    if counts.empty:
+        return pd.DataFrame()
+
+    # keep every age group for each observed group and sex
+    age_intervals = pd.IntervalIndex.from_breaks(
+        age_groups + [float("inf")], closed="left"
+    )
+    counts = counts.reindex(
+        pd.MultiIndex.from_product(
+            [
+                counts.index.unique("group").sort_values(),
+                pd.CategoricalIndex(age_intervals, categories=age_intervals),
+                counts.index.unique(sex_column).sort_values(),
+            ],
+            names=counts.index.names,
+        ),
+        fill_value=0,
     )
 
+    # group by age and sex
+    plot_data = counts.unstack(sex_column, fill_value=0).reset_index()
+
     # ensure 'male' and 'female' columns exist
     if "male" not in plot_data.columns:
         plot_data["male"] = 0
@@ -73,6 +103,13 @@ def preprocess(data, config):
     return plot_data
 
 
+def preprocess(data, config):
+    """
+    Preprocesses data for pyramid plot.
+    """
+    return finalize(aggregate(data, config), config)
+
+
 def get_nice_round_number(value):
     scale = 10 ** (len(str(int(value))) - 1)
     nice_values = [1, 2, 5, 10]
@@ -101,24 +138,22 @@ def plot(plot_data, config, out_dir):
     fig_height = config.get("fig_height", 500)
     export = config.get("export", True)
     filestem = config.get("filestem", "age_sex_pyramid_plot")
+    # groups shown in tabs (one figure each) or in a single figure with a dropdown
+    group_display = config.get("group_display", "tabs")
 
     # map age groups to nice labels
     plot_data["age_group_labels"] = plot_data["age_group"].apply(get_nice_age_label)
 
-    # get unique groups
-    seen = set()
-    groups = []
-    for item in plot_data["group"].unique():
-        lower_item = item.lower()
-        if lower_item not in seen:
-            seen.add(lower_item)
-            groups.append(item)
-    # create list to store figs
+    # create list to store figs (or, with a dropdown, the figure of each group)
     figs_html = []
-    # loop through groups and create plots
-    for group in groups:
-        group_data = plot_data[plot_data["group"] == group]
-
+    group_figs = []
+    # loop through groups (split once) and create plots
+    seen = set()
+    for group, group_data in iter_groups(plot_data, "group"):
+        # groups differing only by case are plotted once
+        if str(group).lower() in seen:
+            continue
+        seen.add(str(group).lower())
         # create figure
         fig = go.Figure()
 
@@ -178,10 +213,11 @@ def plot(plot_data, config, out_dir):
             margin=dict(l=60, r=20, b=60, t=50),
         )
 
-        # convert figure to HTML string
-        fig_html = fig.to_html(full_html=False, include_plotlyjs=False)
-        fig_html = fig_html.replace("<div ", '<div class="plotly-graph-div" ')
-        figs_html.append((fig_html, group))
+        # convert figure to HTML string (unless combined with the other groups)
+        if group_display == "dropdown":
+            group_figs.append((str(group), fig))
+        else:
+            figs_html.append((figure_html(fig), group))
 
         # export plot if specified
         if export:
@@ -198,8 +234,11 @@ def plot(plot_data, config, out_dir):
                 pdf_filename, format="pdf", width=fig_width, height=fig_height
             )
 
+    # if a dropdown is specified, return a single figure holding every group
+    if group_display == "dropdown":
+        return figure_html(group_figure(group_figs), typed_arrays=True)
     # if multiple groups, return tabbed display
-    if len(groups) > 1:
+    if len(figs_html) > 1:
         return generate_tabbed_html(filestem, figs_html)
     else:
         return figs_html[0][0]
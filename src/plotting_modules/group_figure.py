@@ -0,0 +1,133 @@
+import base64
+import numpy as np
+import plotly.io as pio
+import plotly.graph_objects as go
+from plotly.offline import get_plotlyjs_version
+
+# whether the plotly.js bundled with the installed plotly (which reports load, see
+# modules.report_generator) understands typed arrays, i.e. plotly.js >= 2.28
+TYPED_ARRAYS_SUPPORTED = tuple(
+    int(part) for part in get_plotlyjs_version().split(".")[:2]
+) >= (2, 28)
+
+# typed arrays understood by plotly.js, by numpy dtype
+TYPED_ARRAY_DTYPES = {
+    np.dtype("int8"): "i1",
+    np.dtype("uint8"): "u1",
+    np.dtype("int16"): "i2",
+    np.dtype("uint16"): "u2",
+    np.dtype("int32"): "i4",
+    np.dtype("uint32"): "u4",
+    np.dtype("float32"): "f4",
+    np.dtype("float64"): "f8",
+}
+
+
+def typed_array(array):
+    """
+    Encodes a numeric numpy array as a plotly.js typed array, i.e. its binary data
+    encoded in base64 (rather than one JSON number per value), or returns None if the
+    array is not numeric. 64-bit integers are encoded as 32-bit integers if they fit,
+    as floats otherwise.
+    """
+    if array.dtype.kind not in "iuf" or array.ndim != 1:
+        return None
+    if array.dtype not in TYPED_ARRAY_DTYPES:
+        if array.dtype.kind in "iu" and (
+            len(array) == 0
+            or (
+                array.min() >= np.iinfo(np.int32).min
+                and array.max() <= np.iinfo(np.int32).max
+            )
+        ):
+            array = array.astype(np.int32)
+        else:
+            array = array.astype(np.float64)
+    return {
+        "dtype": TYPED_ARRAY_DTYPES[array.dtype],
+        # plotly.js reads typed arrays as little-endian
+        "bdata": base64.b64encode(
+            np.ascontiguousarray(array, dtype=array.dtype.newbyteorder("<")).tobytes()
+        ).decode("ascii"),
+    }
+
+
+def encode_typed_arrays(value):
+    # encode the numeric arrays of (the traces of) a figure as typed arrays
+    if isinstance(value, dict):
+        return {key: encode_typed_arrays(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [encode_typed_arrays(item) for item in value]
+    if isinstance(value, np.ndarray):
+        encoded_array = typed_array(value)
+        return encoded_array if encoded_array is not None else value
+    return value
+
+
+def figure_html(fig, typed_arrays=False):
+    """
+    Converts a Plotly figure into an HTML string (without plotly.js), encoding the
+    numeric data of its traces as typed arrays if specified (and supported by the
+    plotly.js loaded by reports, see TYPED_ARRAYS_SUPPORTED).
+    """
+    figure = fig.to_plotly_json()
+    if typed_arrays and TYPED_ARRAYS_SUPPORTED:
+        figure["data"] = encode_typed_arrays(figure["data"])
+    fig_html = pio.to_html(
+        figure, full_html=False, include_plotlyjs=False, validate=False
+    )
+    return fig_html.replace("<div ", '<div class="plotly-graph-div" ')
+
+
+def group_figure(figures):
+    """
+    Combines the figures of different groups, given as (group name, figure) pairs, into
+    a single figure holding the traces of every group, with a dropdown menu switching
+    between groups on the client side (showing only the traces of the selected group,
+    with its axes). The layout of the first figure is shared by all groups.
+    """
+    if len(figures) == 1:
+        return figures[0][1]
+
+    fig = go.Figure(layout=figures[0][1].layout)
+    trace_groups = []
+    for index, (_, group_fig) in enumerate(figures):
+        for trace in group_fig.data:
+            trace.visible = index == 0
+            fig.add_trace(trace)
+            trace_groups.append(index)
+
+    buttons = []
+    for index, (group_name, group_fig) in enumerate(figures):
+        # axes of the group (e.g. ticks scaled to its counts)
+        layout = group_fig.layout.to_plotly_json()
+        axes = {
+            name: layout.get(name, {})
+            for name in ["xaxis", "yaxis", "yaxis2"]
+            if name in layout or name != "yaxis2"
+        }
+        buttons.append(
+            dict(
+                label=group_name[:1].upper() + group_name[1:],
+                method="update",
+                args=[
+                    {"visible": [trace_group == index for trace_group in trace_groups]},
+                    axes,
+                ],
+            )
+        )
+    fig.update_layout(
+        updatemenus=[
+            dict(
+                type="dropdown",
+                buttons=buttons,
+                active=0,
+                showactive=True,
+                x=1,
+                xanchor="right",
+                y=1.15,
+                yanchor="top",
+            )
+        ]
+    )
+    return fig
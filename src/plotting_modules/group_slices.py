@@ -0,0 +1,23 @@
+import numpy as np
+import pandas as pd
+
+
+def iter_groups(data, column):
+    """
+    Yields the value and rows of each group of rows sharing the same value in a column
+    of a dataframe, in order of first appearance (rows with missing values being left
+    out), like data[data[column] == value] for each value of data[column].unique(), but
+    splitting the dataframe once rather than scanning it for each group: rows are
+    ordered by group once (unless groups are already contiguous), such that each group
+    is a contiguous slice of rows.
+    """
+    codes, values = pd.factorize(data[column], sort=False)
+    # groups are contiguous if codes never decrease (codes follow order of appearance)
+    order = None
+    if np.any(codes[1:] < codes[:-1]) or (len(codes) > 0 and codes[0] < 0):
+        order = np.argsort(codes, kind="stable")
+        codes = codes[order]
+    bounds = np.searchsorted(codes, np.arange(len(values) + 1))
+    for code, value in enumerate(values):
+        rows = slice(bounds[code], bounds[code + 1])
+        yield value, data.iloc[rows if order is None else order[rows]]
@@ -4,72 +4,79 @@ import base64
 import pandas as pd
 import geopandas as gpd
 import matplotlib.pyplot as plt
-from datetime import datetime, timedelta
+from datetime import datetime
 from matplotlib.colors import LinearSegmentedColormap
 
-from modules.data_filtering import apply_filters
+from modules.aggregation import count_rows
+from modules.data_filtering import select_rows
+from modules.epiweek import config_period, period_range, period_start
 from plotting_modules.add_tabs import generate_tabbed_html
+from plotting_modules.group_slices import iter_groups
 
 
-def preprocess(data, config):
+def aggregate(data, config):
     """
-    Preprocesses data for the spatial-map plot.
+    Aggregates data for the spatial-map plot into counts by location (and by first day
+    of each epiweek, or of each day, month or year, if specified).
+    Counts aggregated from different chunks of data can be combined with combine_counts.
     """
     filtering_config = config.get("filtering", [])
     loc_column = config.get("loc_column")
     aggregation_config = config.get("aggregation", {})
 
-    # apply filters
-    filtered_data = apply_filters(data, filtering_config)
-    # return empty dataframe if no data left after filtering
-    if filtered_data.empty:
-        return pd.DataFrame()
-
-    # create a copy of relevant column
-    plot_data = filtered_data.copy()
+    # apply filters (selecting rows into a new dataframe that can be modified)
+    plot_data = select_rows(data, filtering_config)
+    # return empty counts if no data left after filtering
+    if plot_data.empty:
+        return pd.Series(dtype="int64")
 
     # check that loc_column is in data
     if loc_column not in plot_data.columns:
         raise ValueError(f"Column '{loc_column}' not found in data.")
 
     # if aggregation is not specified, then group by loc_column
-    aggregate_by_epiweek = aggregation_config.get("by_epiweek", False)
-    if not aggregate_by_epiweek:
-        plot_data = plot_data.groupby(loc_column).size().reset_index(name="count")
-        # add dummy date column
-        plot_data["date"] = datetime.strptime("2020-01-01", "%Y-%m-%d")
-    else:  # aggregate by epiweek
-        # get the time column
-        time_column = aggregation_config.get("time_column")
-        # check that time_column is in data
-        if time_column not in plot_data.columns:
-            raise ValueError(f"Column '{time_column}' not found in data.")
-
-        # convert time_col to datetime
-        plot_data[time_column] = pd.to_datetime(plot_data[time_column])
-
-        # extract epiweek from the date using the isocalendar() method
-        plot_data["year"], plot_data["epiweek"], _ = (
-            plot_data[time_column].dt.isocalendar().values.T
-        )
-        plot_data = (
-            plot_data.groupby(["year", "epiweek", loc_column])
-            .size()
-            .reset_index(name="count")
-        )
+    period, week_convention, week_anchor = config_period(aggregation_config)
+    if period is None:
+        return count_rows(plot_data, loc_column)
+
+    # get the time column
+    time_column = aggregation_config.get("time_column")
+    # check that time_column is in data
+    if time_column not in plot_data.columns:
+        raise ValueError(f"Column '{time_column}' not found in data.")
+
+    # roll dates up to the first day of their period (e.g. epiweek)
+    plot_data["date"] = period_start(
+        plot_data[time_column], period, week_convention, week_anchor
+    )
+    return count_rows(plot_data, ["date", loc_column])
 
-        # add start of each epiweek as date
-        plot_data["date"] = plot_data.apply(
-            lambda x: datetime.strptime(
-                "%d-W%d-1" % (x["year"], x["epiweek"]), "%G-W%V-%u"
-            )
-            - timedelta(days=1),
-            axis=1,
-        )
 
+def finalize(counts, config):
+    """
+    Turns the counts aggregated for the spatial-map plot into plot data.
+    """
+    loc_column = config.get("loc_column")
+    aggregation_config = config.get("aggregation", {})
+
+    # return empty dataframe if nothing was counted
+    if counts.empty:
+        return pd.DataFrame()
+
+    plot_data = counts.reset_index(name="count")
+
+    period, week_convention, week_anchor = config_period(aggregation_config)
+    if period is None:
+        # add dummy date column
+        plot_data["date"] = datetime.strptime("2020-01-01", "%Y-%m-%d")
+    else:  # aggregate by epiweek (or other period)
         # add 0 count for missing dates
-        all_dates = pd.date_range(
-            plot_data["date"].min(), plot_data["date"].max(), freq="W"
+        all_dates = period_range(
+            plot_data["date"].min(),
+            plot_data["date"].max(),
+            period,
+            week_convention,
+            week_anchor,
         )
         all_dates_df = pd.DataFrame(all_dates.date, columns=["date"])
         all_dates_df["date"] = pd.to_datetime(all_dates_df["date"]).dt.date
@@ -86,6 +93,13 @@ def preprocess(data, config):
     return plot_data
 
 
+def preprocess(data, config):
+    """
+    Preprocesses data for the spatial-map plot.
+    """
+    return finalize(aggregate(data, config), config)
+
+
 def plot(plot_data, config, out_dir):
     if len(plot_data) == 0:
         return "<p>No data available for the selected filters.</p>"
@@ -115,15 +129,12 @@ def plot(plot_data, config, out_dir):
         "red_blue", ["#9db09f", "#a16272", "#9F2241"]
     )
 
-    # get unique dates
-    dates = plot_data["date"].unique()
+    # split data by date (once)
+    dates = list(iter_groups(plot_data, "date"))
     # create list to store figs
     figs_html = []
     # iterate over dates and plot each map
-    for date in dates:
-        # filter data for the specific date
-        date_data = plot_data[plot_data["date"] == date]
-
+    for date, date_data in dates:
         # merge data with geographic data
         geo_data = gdf.merge(
             date_data, left_on=id_column, right_on="loc_column", how="left"
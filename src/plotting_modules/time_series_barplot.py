@@ -1,32 +1,41 @@
+import numpy as np
 import pandas as pd
-from datetime import datetime, timedelta
 import plotly.express as px
 import plotly.graph_objects as go
 import os
 
-from modules.data_filtering import apply_filters
+from modules.aggregation import count_rows
+from modules.data_filtering import select_rows
+from modules.epiweek import config_period, period_range, period_start
+from modules.rolling_statistics import rolling_statistics
 from plotting_modules.add_tabs import generate_tabbed_html
+from plotting_modules.group_figure import figure_html, group_figure
+from plotting_modules.group_slices import iter_groups
 
 
-def preprocess(data, config):
+def age_group_label(age_interval):
+    if age_interval.right == float("inf"):
+        return f"{int(age_interval.left)}+"
+    return "%d-%d" % (int(age_interval.left), int(age_interval.right))
+
+
+def aggregate(data, config):
     """
-    Preprocesses data for the time-series bar plot.
+    Aggregates data for the time-series bar plot into counts by date (or by first day of
+    each epiweek, month or year) and group.
+    Counts aggregated from different chunks of data can be combined with combine_counts.
     """
     filtering_config = config.get("filtering", [])
     time_column = config.get("time_column")
-    by_epiweek = config.get("by_epiweek", False)
-    moving_average_window = config.get("moving_average_window", None)
+    period, week_convention, week_anchor = config_period(config, "day")
     group_by = config.get("group_by", None)
     group_by_age_config = config.get("group_by_age", {})
 
-    # apply filters
-    filtered_data = apply_filters(data, filtering_config)
-    # return empty dataframe if no data left after filtering
-    if filtered_data.empty:
-        return pd.DataFrame()
-
-    # create a copy of relevant column
-    plot_data = filtered_data.copy()
+    # apply filters (selecting rows into a new dataframe that can be modified)
+    plot_data = select_rows(data, filtering_config)
+    # return empty counts if no data left after filtering
+    if plot_data.empty:
+        return pd.Series(dtype="int64")
 
     # check that time_column is in data
     if time_column not in plot_data.columns:
@@ -42,7 +51,7 @@ def preprocess(data, config):
             raise ValueError(f"Column '{age_column}' not found in data.")
 
         # add inf to the last age group
-        age_groups.append(float("inf"))
+        age_groups = age_groups + [float("inf")]
 
         # create age bins
         plot_data[age_column] = plot_data[age_column].apply(
@@ -54,11 +63,7 @@ def preprocess(data, config):
         group_by = "age_group"
 
         # rename age_group to human readable format
-        plot_data["age_group"] = plot_data["age_group"].apply(
-            lambda x: "%d-%d" % (int(x.left), int(x.right))
-            if x.right != float("inf")
-            else f"{int(x.left)}+"
-        )
+        plot_data["age_group"] = plot_data["age_group"].apply(age_group_label)
 
     # check also group_by column
     if group_by and group_by not in plot_data.columns:
@@ -68,74 +73,153 @@ def preprocess(data, config):
     else:  # rename group_by column to group
         plot_data.rename(columns={group_by: "group"}, inplace=True)
 
-    # convert time_col to datetime
-    plot_data[time_column] = pd.to_datetime(plot_data[time_column])
+    # drop categories of a categorical group_by column that are no longer present
+    if isinstance(plot_data["group"].dtype, pd.CategoricalDtype):
+        plot_data["group"] = plot_data["group"].cat.remove_unused_categories()
 
-    # aggregate by epiweek if specified
-    if by_epiweek:
-        # extract epiweek from the date using the isocalendar() method
-        plot_data["year"], plot_data["epiweek"], _ = (
-            plot_data[time_column].dt.isocalendar().values.T
-        )
-        plot_data = (
-            plot_data.groupby(["year", "epiweek", "group"], observed=False)
-            .size()
-            .reset_index(name="count")
+    # roll dates up to the first day of their period (day, epiweek, month or year)
+    plot_data["date"] = period_start(
+        plot_data[time_column], period, week_convention, week_anchor
+    )
+
+    # count only observed combinations, the missing ones are filled in by finalize
+    return count_rows(plot_data, ["date", "group"])
+
+
+def dense_counts(counts, config):
+    """
+    Turns the counts aggregated for the time-series bar plot into a dense matrix of
+    counts, with one row per date (or period) from the first to the last observed one
+    and one column per group (sorted, groups differing only by case being kept once),
+    missing dates and groups being counted 0. Returns the dates, groups and matrix.
+    """
+    period, week_convention, week_anchor = config_period(config, "day")
+    group_by_age_config = config.get("group_by_age", {})
+
+    dates = counts.index.get_level_values("date")
+    count_groups = counts.index.get_level_values("group")
+    all_dates = period_range(
+        dates.min(), dates.max(), period, week_convention, week_anchor
+    )
+    if group_by_age_config.get("active", False):
+        # every age group, in order
+        age_groups = group_by_age_config.get("age_groups", [0, 18, 45, 65])
+        age_intervals = pd.IntervalIndex.from_breaks(
+            age_groups + [float("inf")], closed="left"
         )
-        # add start of each epiweek as date
-        plot_data["date"] = plot_data.apply(
-            lambda x: datetime.strptime(
-                "%d-W%d-1" % (x["year"], x["epiweek"]), "%G-W%V-%u"
-            )
-            - timedelta(days=1),
-            axis=1,
+        groups = pd.Index(
+            [age_group_label(age_interval) for age_interval in age_intervals],
+            dtype=object,
         )
     else:
-        plot_data["date"] = pd.to_datetime(plot_data[time_column]).dt.date
-        plot_data = (
-            plot_data.groupby(["date", "group"], observed=False)
-            .size()
-            .reset_index(name="count")
-        )
+        groups = count_groups.unique().astype(object)
+        groups = groups[~groups.astype(str).str.lower().duplicated()].sort_values()
+
+    matrix = np.zeros((len(all_dates), len(groups)))
+    rows = all_dates.get_indexer(dates)
+    columns = groups.get_indexer(count_groups)
+    kept = columns >= 0
+    matrix[rows[kept], columns[kept]] = counts.to_numpy()[kept]
+    return all_dates, groups, matrix
 
-    # add 0 count for missing dates
-    all_dates = pd.date_range(
-        plot_data["date"].min(),
-        plot_data["date"].max(),
-        freq="D" if not by_epiweek else "W",
-    )
 
-    # create combinations of all dates and unique groups
-    seen = set()
-    unique_groups = []
-    for item in plot_data["group"].unique():
-        lower_item = item.lower()
-        if lower_item not in seen:
-            seen.add(lower_item)
-            unique_groups.append(item)
-    all_dates_df = pd.DataFrame(
-        [(d, g) for d in all_dates.date for g in unique_groups],
-        columns=["date", "group"],
+def section_statistics(config):
+    # rolling statistics of a section (see modules.rolling_statistics), including
+    # the moving average if specified
+    statistics = dict(config.get("rolling_statistics") or {})
+    moving_average_window = config.get("moving_average_window", None)
+    if moving_average_window:
+        statistics["moving_average"] = {
+            "statistic": "mean",
+            "window": moving_average_window,
+        }
+    return statistics
+
+
+def check_overlays(config):
+    # rolling statistics shown as overlays (in the plotting config) must be defined
+    # on the section
+    plotting_config = config.get("plotting") or {}
+    # sections are named by their title, or their filestem if untitled
+    section_name = plotting_config.get("title") or plotting_config.get(
+        "filestem", "time_series_barplot"
     )
+    statistics = section_statistics(config)
+    for name in plotting_config.get("rolling_statistics") or {}:
+        if name not in statistics:
+            raise ValueError(
+                f"Rolling statistic '{name}' shown in section '{section_name}' is not "
+                f"defined in its rolling_statistics, expected one of {list(statistics)}."
+            )
 
-    all_dates_df["date"] = pd.to_datetime(all_dates_df["date"]).dt.date
 
-    # merge
-    plot_data["date"] = pd.to_datetime(plot_data["date"]).dt.date
-    plot_data = all_dates_df.merge(plot_data, how="left", on=["date", "group"])
-    plot_data["count"] = plot_data["count"].fillna(0)
-    # sort
-    plot_data.sort_values(by=["date", "group"], inplace=True)
+def finalize(counts, config):
+    """
+    Turns the counts aggregated for the time-series bar plot into plot data, with the
+    rolling statistics of each group (if any) computed in one pass over the dense
+    matrix of counts.
+    """
+    check_overlays(config)
 
-    # calculate moving average if specified
-    if moving_average_window:
-        plot_data["moving_average"] = plot_data.groupby("group")["count"].transform(
-            lambda x: x.rolling(window=moving_average_window, min_periods=1).mean()
-        )
+    # return empty dataframe if nothing was counted
+    if counts.empty:
+        return pd.DataFrame()
+
+    all_dates, groups, matrix = dense_counts(counts, config)
+
+    # one row per date and group, sorted by date and group
+    plot_data = pd.DataFrame(
+        {
+            "date": np.repeat(all_dates.to_numpy(), len(groups)),
+            "group": np.tile(groups.to_numpy(), len(all_dates)),
+            "count": matrix.ravel(),
+        }
+    )
+
+    # calculate rolling statistics (e.g. moving average) over the dates of each group
+    for name, values in rolling_statistics(matrix, section_statistics(config)).items():
+        plot_data[name] = values.ravel()
 
     return plot_data
 
 
+def variables(counts, config):
+    """
+    Returns the template variables of the time-series bar plot, i.e. the latest value
+    of each rolling statistic with a variable name, computed over all groups.
+    """
+    statistics = {
+        name: statistic_config
+        for name, statistic_config in (config.get("rolling_statistics") or {}).items()
+        if statistic_config.get("variable") is not None
+    }
+    if not statistics:
+        return {}
+    if counts.empty:
+        return {statistics[name]["variable"]: "N/A" for name in statistics}
+
+    _, _, matrix = dense_counts(counts, config)
+    total_counts = matrix.sum(axis=1, keepdims=True)
+    section_variables = {}
+    for name, values in rolling_statistics(total_counts, statistics).items():
+        value = float(values[-1, 0])
+        if np.isnan(value):
+            value = "N/A"
+        elif value.is_integer():
+            value = int(value)
+        else:
+            value = round(value, 2)
+        section_variables[statistics[name]["variable"]] = value
+    return section_variables
+
+
+def preprocess(data, config):
+    """
+    Preprocesses data for the time-series bar plot.
+    """
+    return finalize(aggregate(data, config), config)
+
+
 def plot(plot_data, config, out_dir):
     """
     Creates a time-series bar plot using preprocessed data.
@@ -149,6 +233,8 @@ def plot(plot_data, config, out_dir):
     fig_height = config.get("fig_height", 500)
     export = config.get("export", True)
     filestem = config.get("filestem", "time_series_barplot")
+    # groups shown in tabs (one figure each) or in a single figure with a dropdown
+    group_display = config.get("group_display", "tabs")
 
     # extract parameters for moving average
     ma_params = config.get("moving_average", {})
@@ -156,18 +242,22 @@ def plot(plot_data, config, out_dir):
     ma_lw = ma_params.get("linewidth", 2)
     ma_colour = ma_params.get("colour", "#B4A269")
 
+    # extract parameters for rolling statistics shown as overlays
+    overlays = {
+        name: overlay_params
+        for name, overlay_params in (config.get("rolling_statistics") or {}).items()
+        if overlay_params.get("show", False)
+    }
+
     # if no data, return html that says so
     if plot_data.empty:
         return "<h4>%s (no data available)</h4>" % title
 
-    # get unique groups
-    groups = plot_data["group"].unique()
-    # create list to store figs
+    # create list to store figs (or, with a dropdown, the figure of each group)
     figs_html = []
-    # loop through groups and create plots
-    for group in groups:
-        group_data = plot_data[plot_data["group"] == group]
-
+    group_figs = []
+    # loop through groups (split once) and create plots
+    for group, group_data in iter_groups(plot_data, "group"):
         # create plot
         fig = px.bar(
             group_data,
@@ -199,10 +289,38 @@ def plot(plot_data, config, out_dir):
                 )
             )
 
-        # convert figure to HTML string
-        fig_html = fig.to_html(full_html=False, include_plotlyjs=False)
-        fig_html = fig_html.replace("<div ", '<div class="plotly-graph-div" ')
-        figs_html.append((fig_html, str(group)))
+        # add a line for each rolling statistic shown as an overlay, rates (e.g.
+        # growth rates) being plotted against a secondary y-axis if specified
+        for name, overlay_params in overlays.items():
+            secondary_y = overlay_params.get("secondary_y", False)
+            fig.add_trace(
+                go.Scatter(
+                    x=group_data["date"],
+                    y=group_data[name],
+                    mode="lines",
+                    name=overlay_params.get("label", name),
+                    line=dict(
+                        color=overlay_params.get("colour"),
+                        width=overlay_params.get("linewidth", 2),
+                    ),
+                    yaxis="y2" if secondary_y else "y",
+                )
+            )
+            if secondary_y:
+                fig.update_layout(
+                    yaxis2=dict(
+                        title=overlay_params.get("y_label"),
+                        overlaying="y",
+                        side="right",
+                        showgrid=False,
+                    )
+                )
+
+        # convert figure to HTML string (unless combined with the other groups)
+        if group_display == "dropdown":
+            group_figs.append((str(group), fig))
+        else:
+            figs_html.append((figure_html(fig), str(group)))
 
         # export plot if specified
         if export:
@@ -219,8 +337,11 @@ def plot(plot_data, config, out_dir):
                 pdf_filename, format="pdf", width=fig_width, height=fig_height
             )
 
+    # if a dropdown is specified, return a single figure holding every group
+    if group_display == "dropdown":
+        return figure_html(group_figure(group_figs), typed_arrays=True)
     # if multiple groups, return tabbed display
-    if len(groups) > 1:
+    if len(figs_html) > 1:
         return generate_tabbed_html(filestem, figs_html)
     else:
         return figs_html[0][0]
@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+PROVINCES = ["South Kivu", "North Kivu", "Kinshasa", "Ituri"]
+CASE_CLASSIFICATIONS = ["confirmed", "probable", "suspected", "negative"]
+CASE_STATUSES = ["alive", "died", "unknown"]
+SEXES = ["female", "male", "unknown"]
+
+
+def make_linelist(n=600, seed=0, start=0):
+    """
+    Returns a synthetic linelist as exported from InsightBoard, i.e. with every value
+    as text, including malformed and missing entries (e.g. 'unknown' ages).
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.Timestamp("2023-12-20") + pd.to_timedelta(
+        rng.integers(0, 120, n), unit="D"
+    )
+    linelist = pd.DataFrame(
+        {
+            "record_id": ["EPI_%05d" % i for i in range(start, start + n)],
+            "loc_admin_1": rng.choice(PROVINCES, n),
+            "notification_date": dates.strftime("%Y-%m-%d"),
+            "case_classification": rng.choice(CASE_CLASSIFICATIONS, n),
+            "case_status": rng.choice(CASE_STATUSES, n),
+            "sex_at_birth": rng.choice(SEXES, n),
+            "age_years": rng.integers(0, 90, n).astype(str),
+            "health_worker": rng.choice(["True", "False", "yes", "n"], n),
+        }
+    )
+    linelist.loc[rng.random(n) < 0.05, "age_years"] = "unknown"
+    linelist.loc[rng.random(n) < 0.05, "age_years"] = ""
+    linelist.loc[rng.random(n) < 0.03, "notification_date"] = "not a date"
+    linelist.loc[rng.random(n) < 0.05, "loc_admin_1"] = ""
+    return linelist
+
+
+@pytest.fixture
+def linelist_file(tmp_path):
+    linelist_file = tmp_path / "linelist.csv"
+    make_linelist().to_csv(linelist_file, index=False)
+    return linelist_file
+
+
+@pytest.fixture
+def sections():
+    # plot sections of a report (only aggregated, not plotted)
+    return [
+        {"type": "text", "content": "{{ total_cases }}"},
+        {
+            "type": "time-series-barplot",
+            "time_column": "notification_date",
+            "by_epiweek": True,
+            "group_by": "case_classification",
+            "filtering": [
+                {"type": "str", "column": "case_status", "exclude": ["unknown"]}
+            ],
+        },
+        {
+            "type": "age-sex-pyramid",
+            "age_column": "age_years",
+            "sex_column": "sex_at_birth",
+            "group_by": "case_classification",
+        },
+        {
+            "type": "spatial-map",
+            "loc_column": "loc_admin_1",
+            "aggregation": {"period": "month", "time_column": "notification_date"},
+        },
+    ]
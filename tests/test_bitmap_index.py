@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from modules.bitmap_index import BitmapIndex, SortedIndex, build_indexes
+from modules.data_filtering import filter_mask, frame_cache
+from modules.linelist_loader import load_linelist
+from modules.populate_variables import summarise
+
+INDEXED_COLUMNS = [
+    "notification_date",
+    "loc_admin_1",
+    "case_status",
+    "sex_at_birth",
+    "age_years",
+]
+
+FILTERS = [
+    [{"type": "str", "column": "loc_admin_1", "include": ["Ituri", "South Kivu"]}],
+    [{"type": "str", "column": "loc_admin_1", "exclude": ["Ituri", "Goma"]}],
+    [
+        {
+            "type": "str",
+            "column": "case_status",
+            "include": ["died", "alive"],
+            "exclude": ["alive"],
+        }
+    ],
+    [{"type": "date", "column": "notification_date", "min": "2024-01-10"}],
+    [{"type": "date", "column": "notification_date", "max": "2024-02-01"}],
+    [{"type": "int", "column": "age_years", "min": 18, "max": 64}],
+    [
+        {"type": "str", "column": "sex_at_birth", "include": ["male"]},
+        {"type": "date", "column": "notification_date", "min": "2024-01-01"},
+        {"type": "str", "column": "case_classification", "exclude": ["negative"]},
+    ],
+]
+
+
+def counts_by_value(counts):
+    # counts of each (non-missing) value, and of missing values, leaving out zeros
+    counts = counts[counts > 0]
+    missing = counts.index.isna()
+    return counts[~missing].to_dict(), int(counts[missing].sum())
+
+
+@pytest.fixture
+def linelist(linelist_file):
+    return load_linelist(linelist_file)
+
+
+@pytest.mark.parametrize("config", FILTERS)
+def test_index_filter_matches_mask_filter(linelist, config):
+    expected = filter_mask(linelist.copy(), config)
+    build_indexes(linelist, INDEXED_COLUMNS)
+    np.testing.assert_array_equal(filter_mask(linelist, config), expected)
+
+
+def test_build_indexes_kinds(linelist):
+    build_indexes(linelist, INDEXED_COLUMNS + ["not_a_column"])
+    indexes = frame_cache(linelist, "indexes")
+    assert set(indexes) == set(INDEXED_COLUMNS)
+    assert isinstance(indexes["loc_admin_1"], BitmapIndex)
+    assert isinstance(indexes["notification_date"], SortedIndex)
+    assert isinstance(indexes["age_years"], SortedIndex)
+
+
+@pytest.mark.parametrize("column", INDEXED_COLUMNS)
+def test_index_value_counts_match_pandas(linelist, column):
+    build_indexes(linelist, [column])
+    value_counts = frame_cache(linelist, "indexes")[column].value_counts()
+    assert counts_by_value(value_counts) == counts_by_value(
+        linelist[column].value_counts(dropna=False)
+    )
+
+
+def test_summary_from_indexes_matches_summary_without(linelist):
+    variable_names = {"total_deaths", "total_male_cases", "earliest_case_date"}
+    expected = summarise(linelist.copy(), variable_names)
+    build_indexes(linelist, INDEXED_COLUMNS)
+    summary = summarise(linelist, variable_names)
+    assert summary["total"] == expected["total"]
+    assert summary["counts"].keys() == expected["counts"].keys()
+    for column, counts in expected["counts"].items():
+        assert counts_by_value(summary["counts"][column]) == counts_by_value(counts)
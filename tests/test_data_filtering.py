@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from modules.data_filtering import (
+    apply_filters,
+    compile_filters,
+    filter_mask,
+    frame_cache,
+    select_rows,
+)
+from modules.linelist_loader import load_linelist
+
+# filtering configs, with the equivalent mask in plain pandas (missing values never
+# passing a filter, except exclude)
+FILTERS = [
+    (
+        [{"type": "date", "column": "notification_date", "min": "2024-01-15"}],
+        lambda df: df["notification_date"] >= "2024-01-15",
+    ),
+    (
+        [
+            {
+                "type": "date",
+                "column": "notification_date",
+                "min": "2024-01-01",
+                "max": "2024-02-29",
+            }
+        ],
+        lambda df: df["notification_date"].between("2024-01-01", "2024-02-29"),
+    ),
+    (
+        [{"type": "str", "column": "loc_admin_1", "include": ["Ituri", "Kinshasa"]}],
+        lambda df: df["loc_admin_1"].isin(["Ituri", "Kinshasa"]),
+    ),
+    (
+        [{"type": "str", "column": "case_status", "exclude": ["unknown"]}],
+        lambda df: ~df["case_status"].isin(["unknown"]),
+    ),
+    (
+        [{"type": "int", "column": "age_years", "min": 18, "max": 64}],
+        lambda df: df["age_years"].between(18, 64).fillna(False),
+    ),
+    (
+        [{"type": "bool", "column": "health_worker", "take_only": True}],
+        lambda df: (df["health_worker"] == True).fillna(False),  # noqa: E712
+    ),
+    (
+        [
+            {"type": "str", "column": "sex_at_birth", "include": ["female"]},
+            {"type": "int", "column": "age_years", "min": 18},
+            {"type": "str", "column": "not_a_column", "include": ["x"]},
+            {"type": "unknown_type", "column": "case_status", "include": ["died"]},
+        ],
+        lambda df: (df["sex_at_birth"] == "female") & (df["age_years"] >= 18),
+    ),
+    (None, lambda df: pd.Series(True, index=df.index)),
+]
+
+
+@pytest.fixture
+def linelist(linelist_file):
+    return load_linelist(linelist_file)
+
+
+@pytest.mark.parametrize("config, expected_mask", FILTERS)
+def test_filter_mask_matches_pandas(linelist, config, expected_mask):
+    expected = expected_mask(linelist).to_numpy(dtype=bool, na_value=False)
+    np.testing.assert_array_equal(filter_mask(linelist, config), expected)
+    # evaluated again from the memoized bitmaps
+    np.testing.assert_array_equal(filter_mask(linelist, config), expected)
+
+
+@pytest.mark.parametrize("config, expected_mask", FILTERS)
+def test_apply_filters_matches_pandas(linelist, config, expected_mask):
+    expected = linelist[expected_mask(linelist).to_numpy(dtype=bool, na_value=False)]
+    pd.testing.assert_frame_equal(apply_filters(linelist, config), expected)
+    pd.testing.assert_frame_equal(select_rows(linelist, config), expected)
+    columns = {"age_years", "loc_admin_1"}
+    filtered_linelist = apply_filters(linelist, config, columns)
+    if len(expected) < len(linelist):
+        expected = expected[["loc_admin_1", "age_years"]]
+    pd.testing.assert_frame_equal(filtered_linelist, expected)
+
+
+def test_apply_filters_without_filtered_rows_returns_dataframe(linelist):
+    config = [{"type": "date", "column": "notification_date", "min": "2000-01-01"}]
+    # rows with missing dates do not pass
+    assert apply_filters(linelist, config) is not linelist
+    assert apply_filters(linelist, None) is linelist
+    assert apply_filters(linelist, None, {"age_years"}) is linelist
+
+
+def test_filter_masks_are_shared_between_plans(linelist):
+    exclude_unknown = {"type": "str", "column": "case_status", "exclude": ["unknown"]}
+    female = {"type": "str", "column": "sex_at_birth", "include": ["female"]}
+    filter_mask(linelist, [exclude_unknown])
+    filter_mask(linelist, [female, exclude_unknown])
+    bitmaps = frame_cache(linelist, "bitmaps")
+    filter_keys = {
+        filter_item["key"]
+        for config in [[exclude_unknown], [female]]
+        for filter_item in compile_filters(config).filters
+    }
+    # one bitmap per filter and per plan (a plan of a single filter sharing the bitmap
+    # of the filter), the filter shared by both plans being evaluated once
+    assert filter_keys <= bitmaps.keys()
+    assert len(bitmaps) == 3
+    # plans listing the same filters in a different order share their bitmap
+    filter_mask(linelist, [exclude_unknown, female])
+    assert len(bitmaps) == 3
@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from modules.epiweek import (
+    config_period,
+    period_range,
+    period_start,
+    week_label,
+    week_start,
+)
+
+DATES = pd.Series(
+    pd.date_range("2019-12-20", "2021-01-10", freq="D").tolist() + [pd.NaT]
+)
+
+
+def expected_days(days):
+    # datetime64[ns] numpy array of the given days
+    return pd.to_datetime(days).to_numpy(dtype="datetime64[ns]")
+
+
+def test_iso_weeks_labelled_by_sunday_before_monday():
+    # labels of earlier versions, i.e. the Sunday before the Monday of the ISO week
+    mondays = DATES - pd.to_timedelta(DATES.dt.dayofweek, unit="D")
+    np.testing.assert_array_equal(
+        period_start(DATES, "week"), expected_days(mondays - pd.Timedelta(days=1))
+    )
+    np.testing.assert_array_equal(
+        period_start(DATES, "week", anchor="start"), expected_days(mondays)
+    )
+    # ISO weeks from their Monday, e.g. week 53 of 2020 and week 1 of 2021
+    iso_weeks = DATES.dropna().dt.isocalendar()[["year", "week"]]
+    starts = pd.Series(pd.to_datetime(week_start(DATES.dropna())))
+    assert (starts.dt.dayofweek == 0).all()
+    pd.testing.assert_frame_equal(
+        starts.dt.isocalendar()[["year", "week"]].set_axis(iso_weeks.index), iso_weeks
+    )
+
+
+def test_mmwr_weeks_start_on_sunday():
+    sundays = DATES - pd.to_timedelta((DATES.dt.dayofweek + 1) % 7, unit="D")
+    for anchor in ["sunday", "start"]:
+        np.testing.assert_array_equal(
+            period_start(DATES, "week", "mmwr", anchor), expected_days(sundays)
+        )
+    # MMWR week 1 of 2020 starts on 2019-12-29, week 53 of 2020 on 2020-12-27
+    labels = pd.to_datetime(week_label(["2020-01-04", "2021-01-02"], "mmwr"))
+    assert list(labels) == [pd.Timestamp("2019-12-29"), pd.Timestamp("2020-12-27")]
+
+
+@pytest.mark.parametrize(
+    "convention, anchor, dayofweek",
+    [("iso", "sunday", 6), ("iso", "start", 0), ("mmwr", "sunday", 6)],
+)
+def test_period_range_matches_period_start(convention, anchor, dayofweek):
+    weeks = period_range("2020-01-01", "2020-12-31", "week", convention, anchor)
+    assert (weeks.dayofweek == dayofweek).all()
+    starts = period_start(
+        pd.date_range("2020-01-08", "2020-12-24"), "week", convention, anchor
+    )
+    assert set(starts) <= set(weeks.to_numpy())
+
+
+def test_month_and_year_starts():
+    np.testing.assert_array_equal(
+        period_start(DATES, "month"),
+        expected_days(DATES.dt.to_period("M").dt.start_time),
+    )
+    np.testing.assert_array_equal(
+        period_start(DATES, "year"),
+        expected_days(DATES.dt.to_period("Y").dt.start_time),
+    )
+    np.testing.assert_array_equal(period_start(DATES, "day"), expected_days(DATES))
+    assert list(period_range("2020-01-15", "2020-04-01", "month")) == list(
+        pd.to_datetime(["2020-02-01", "2020-03-01", "2020-04-01"])
+    )
+
+
+def test_config_period():
+    assert config_period({"by_epiweek": True}) == ("week", "iso", "sunday")
+    assert config_period({}, "day") == ("day", "iso", "sunday")
+    assert config_period(
+        {"period": "month", "week_convention": "mmwr", "week_anchor": "start"}
+    ) == ("month", "mmwr", "start")
+
+
+@pytest.mark.parametrize(
+    "arguments",
+    [("week", "not a convention"), ("week", "iso", "monday"), ("quarter",)],
+)
+def test_unknown_period_raises(arguments):
+    with pytest.raises(ValueError):
+        period_start(DATES, *arguments)
@@ -0,0 +1,93 @@
+import pandas as pd
+import pytest
+
+from modules.linelist_loader import (
+    cached_linelist_file,
+    iter_linelist,
+    load_linelist,
+    read_cached_linelist,
+)
+from modules.populate_variables import summarise, summarise_chunks
+
+pytest.importorskip("pyarrow")
+
+
+def test_load_linelist_from_cache(linelist_file, tmp_path):
+    cache_dir = tmp_path / "cache"
+    linelist = load_linelist(linelist_file)
+    cached_linelist = load_linelist(linelist_file, cache_dir=cache_dir)
+    assert cached_linelist_file(linelist_file, None, cache_dir).exists()
+    pd.testing.assert_frame_equal(cached_linelist, linelist)
+    # read back from the cache, projected
+    pd.testing.assert_frame_equal(
+        load_linelist(linelist_file, cache_dir=cache_dir, columns={"age_years"}),
+        linelist[["age_years"]],
+    )
+
+
+@pytest.mark.parametrize("chunksize", [50, 600])
+def test_iter_linelist_writes_cache(linelist_file, tmp_path, chunksize):
+    cache_dir = tmp_path / "cache"
+    columns = {"loc_admin_1", "age_years"}
+    chunks = list(
+        iter_linelist(linelist_file, cache_dir=cache_dir, columns=columns, chunksize=50)
+    )
+    assert all(list(chunk.columns) == ["loc_admin_1", "age_years"] for chunk in chunks)
+
+    # the cache holds every column, whatever the columns read
+    cache_file = cached_linelist_file(linelist_file, None, cache_dir)
+    pd.testing.assert_frame_equal(
+        read_cached_linelist(cache_file),
+        load_linelist(linelist_file),
+        check_categorical=False,
+    )
+    assert list(cache_dir.iterdir()) == [cache_file]
+
+    # and is read back in chunks
+    cached_chunks = list(
+        iter_linelist(
+            linelist_file, cache_dir=cache_dir, columns=columns, chunksize=chunksize
+        )
+    )
+    assert sum(len(chunk) for chunk in cached_chunks) == 600
+
+
+def test_iter_linelist_stopped_early_leaves_no_cache(linelist_file, tmp_path):
+    cache_dir = tmp_path / "cache"
+    chunks = iter_linelist(linelist_file, cache_dir=cache_dir, chunksize=50)
+    next(chunks)
+    chunks.close()
+    assert list(cache_dir.iterdir()) == []
+
+
+@pytest.mark.parametrize("cached", [False, True])
+def test_chunked_summary_matches_in_memory_summary(linelist_file, tmp_path, cached):
+    cache_dir = tmp_path / "cache" if cached else None
+    variable_names = {"total_cases", "total_deaths", "total_median_age"}
+    dimensions = {"loc_admin_1", "sex_at_birth"}
+    linelist = load_linelist(linelist_file)
+    summary = summarise(linelist, variable_names, dimensions)
+    for _ in range(2 if cached else 1):
+        chunked_summary = summarise_chunks(
+            iter_linelist(linelist_file, cache_dir=cache_dir, chunksize=64),
+            variable_names,
+            dimensions,
+        )
+
+    assert chunked_summary["total"] == summary["total"] == len(linelist)
+    assert chunked_summary["counts"].keys() == summary["counts"].keys()
+    for column, counts in chunked_summary["counts"].items():
+        value_counts = linelist[column].value_counts(dropna=False)
+        pd.testing.assert_series_equal(
+            counts[counts > 0].sort_index(),
+            value_counts[value_counts > 0].sort_index(),
+            check_index_type=False,
+            check_names=False,
+        )
+    pd.testing.assert_series_equal(
+        chunked_summary["cube"]["total"].sort_index(),
+        linelist.groupby(sorted(dimensions), observed=True, dropna=False)
+        .size()
+        .sort_index(),
+        check_index_type=False,
+    )
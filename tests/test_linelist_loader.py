@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from modules.linelist_loader import (
+    BOOLEAN_VALUES,
+    iter_linelist,
+    load_linelist,
+    resolve_schema,
+)
+
+
+def categories_as_values(linelist):
+    # categorical columns as plain values, e.g. to compare chunks holding different
+    # categories with a linelist read at once
+    return linelist.apply(
+        lambda column: (
+            column.astype(object)
+            if isinstance(column.dtype, pd.CategoricalDtype)
+            else column
+        )
+    )
+
+
+def test_resolve_schema_patterns_and_overrides():
+    columns = ["record_id", "loc_admin_1", "date_of_onset", "age_years", "other"]
+    column_types = resolve_schema(columns, {"loc_admin_*": "str", "other": "float"})
+    assert column_types == {
+        "record_id": "str",
+        "loc_admin_1": "str",
+        "date_of_onset": "date",
+        "age_years": "Int16",
+        "other": "float",
+    }
+
+
+def test_load_linelist_types_columns(linelist_file):
+    linelist = load_linelist(linelist_file)
+    assert isinstance(linelist["loc_admin_1"].dtype, pd.CategoricalDtype)
+    assert isinstance(linelist["case_classification"].dtype, pd.CategoricalDtype)
+    assert pd.api.types.is_datetime64_any_dtype(linelist["notification_date"])
+    assert linelist["age_years"].dtype == "Int16"
+    assert linelist["health_worker"].dtype == "boolean"
+
+
+def test_load_linelist_coerces_like_pandas(linelist_file):
+    raw = pd.read_csv(linelist_file, dtype=str, keep_default_na=False)
+    linelist = load_linelist(linelist_file)
+
+    # malformed values are missing rather than failing to load the linelist
+    ages = pd.to_numeric(raw["age_years"], errors="coerce").astype("Int16")
+    pd.testing.assert_series_equal(linelist["age_years"], ages)
+    dates = pd.to_datetime(raw["notification_date"], errors="coerce")
+    pd.testing.assert_series_equal(linelist["notification_date"], dates)
+    health_workers = raw["health_worker"].str.lower().map(BOOLEAN_VALUES)
+    assert (linelist["health_worker"] == health_workers.astype("boolean")).all()
+    pd.testing.assert_series_equal(
+        linelist["loc_admin_1"].astype(object),
+        raw["loc_admin_1"].replace("", np.nan).astype(object),
+        check_dtype=False,
+    )
+
+
+def test_load_linelist_projects_columns(linelist_file):
+    linelist = load_linelist(linelist_file, columns={"age_years", "unknown_column"})
+    assert list(linelist.columns) == ["age_years"]
+    assert len(linelist) == 600
+
+
+@pytest.mark.parametrize("chunksize", [1, 64, 600, 1000])
+def test_iter_linelist_matches_load_linelist(linelist_file, chunksize):
+    columns = {"loc_admin_1", "notification_date", "age_years", "health_worker"}
+    chunks = list(iter_linelist(linelist_file, columns=columns, chunksize=chunksize))
+    assert all(len(chunk) <= chunksize for chunk in chunks)
+    linelist = load_linelist(linelist_file, columns=columns)
+    pd.testing.assert_frame_equal(
+        categories_as_values(pd.concat(chunks, ignore_index=True)),
+        categories_as_values(linelist),
+    )
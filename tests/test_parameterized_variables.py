@@ -0,0 +1,101 @@
+import re
+
+import pytest
+
+from modules.linelist_loader import iter_linelist, load_linelist
+from modules.populate_variables import (
+    find_and_replace,
+    parse_parameters,
+    summarise_chunks,
+    template_dimensions,
+    template_values,
+)
+
+HTML = (
+    "<p>{{ total_cases }} {{ total_deaths[loc_admin_1=South Kivu] }}"
+    " {{ total_confirmed_cases[health_worker=True] }}"
+    " {{ total_median_age[sex_at_birth=female] }}</p>"
+    "<p>{{ total_cases[loc_admin_1] }}</p>"
+    "<p>{{ total_deaths[case_classification, sex_at_birth=female] }}</p>"
+)
+
+
+def table_rows(table):
+    # rows of an HTML table of the values of a variable for each group
+    return [
+        re.findall(r"<td>(.*?)</td>", row)
+        for row in re.findall(r"<tr>(.*?)</tr>", table)
+    ][1:]
+
+
+@pytest.fixture
+def linelist(linelist_file):
+    return load_linelist(linelist_file)
+
+
+@pytest.fixture(params=["dataframe", "chunks"])
+def data(request, linelist, linelist_file):
+    # a linelist in memory, or the summary of the linelist read in chunks
+    if request.param == "dataframe":
+        return linelist
+    return summarise_chunks(
+        iter_linelist(linelist_file, chunksize=64),
+        dimensions=template_dimensions(HTML),
+    )
+
+
+def test_parse_parameters():
+    assert parse_parameters(" case_classification, sex_at_birth = female ") == (
+        ("case_classification",),
+        (("sex_at_birth", "female"),),
+    )
+
+
+def test_scoped_values_match_pandas(linelist, data):
+    values = template_values(HTML, data)
+    south_kivu = linelist[linelist["loc_admin_1"] == "South Kivu"]
+    assert values["total_cases"] == len(linelist)
+    assert values["total_deaths[loc_admin_1=South Kivu]"] == int(
+        (south_kivu["case_status"] == "died").sum()
+    )
+    health_workers = linelist[linelist["health_worker"].fillna(False)]
+    assert values["total_confirmed_cases[health_worker=True]"] == int(
+        (health_workers["case_classification"] == "confirmed").sum()
+    )
+    female_ages = linelist.loc[linelist["sex_at_birth"] == "female", "age_years"]
+    assert values["total_median_age[sex_at_birth=female]"] == int(
+        female_ages.dropna().astype(float).median()
+    )
+
+
+def test_grouped_values_match_pandas(linelist, data):
+    values = template_values(HTML, data)
+
+    counts = linelist.groupby("loc_admin_1", observed=True).size()
+    assert table_rows(values["total_cases[loc_admin_1]"]) == [
+        [str(province), str(count)] for province, count in counts.items()
+    ]
+
+    female = linelist[linelist["sex_at_birth"] == "female"]
+    deaths = (
+        (female["case_status"] == "died")
+        .groupby(female["case_classification"], observed=True)
+        .sum()
+    )
+    assert table_rows(
+        values["total_deaths[case_classification,sex_at_birth=female]"]
+    ) == [[str(group), str(count)] for group, count in deaths.items()]
+
+
+def test_placeholders_on_unknown_columns_are_left_unresolved(linelist):
+    html = "{{ total_cases[not_a_column=x] }} {{ total_cases[not_a_column] }}"
+    populated_html, replacements_count = find_and_replace(html, linelist)
+    assert populated_html == html
+    assert replacements_count == 0
+
+
+def test_placeholders_are_populated(linelist):
+    populated_html, replacements_count = find_and_replace(HTML, linelist)
+    assert replacements_count == 6
+    assert "{{" not in populated_html
+    assert populated_html.startswith("<p>%d " % len(linelist))
@@ -0,0 +1,74 @@
+import random
+
+import pytest
+
+from modules.placeholder_scanner import (
+    PLACEHOLDER_PATTERN,
+    iter_placeholders,
+    iter_segments,
+    placeholders_text,
+    read_chunks,
+)
+
+# placeholders x, z and w are scanned, those in scripts and data URIs are not
+HTML = (
+    '<p>{{ x }}</p><img src="data:image/png;base64,AAAA{{ y }}BBBB">'
+    "<p>{{ z[loc_admin_1=South Kivu] }}</p>"
+    "<script>var a = '{{ s }}';</script>"
+    '<div style="background: url(data:image/png;base64,CC{{ u }}CC)">{ {{ w }} }}</div>'
+    "<img src='data:,{{ v }}'> {{ not a placeholder }}"
+)
+SCANNED = ["x", "z", "w"]
+
+
+def split(text, positions):
+    # split a text into chunks at the given positions
+    positions = [0] + sorted(positions) + [len(text)]
+    return [text[start:end] for start, end in zip(positions, positions[1:])]
+
+
+def scanned_placeholders(chunks):
+    segments = list(iter_segments(chunks))
+    # the segments are the document, as is
+    assert "".join(text for text, _ in segments) == "".join(chunks)
+    return [match.group(1) for _, match in segments if match is not None]
+
+
+def test_placeholders_whole_document():
+    assert scanned_placeholders([HTML]) == SCANNED
+
+
+@pytest.mark.parametrize("chunk_size", range(1, 40))
+def test_placeholders_split_in_fixed_size_chunks(chunk_size):
+    chunks = split(HTML, list(range(chunk_size, len(HTML), chunk_size)))
+    assert scanned_placeholders(chunks) == SCANNED
+
+
+def test_placeholders_split_at_any_position():
+    for position in range(1, len(HTML)):
+        assert scanned_placeholders(split(HTML, [position])) == SCANNED
+
+
+def test_placeholders_split_at_random_positions():
+    generator = random.Random(0)
+    for _ in range(500):
+        positions = generator.sample(range(1, len(HTML)), generator.randint(1, 30))
+        assert scanned_placeholders(split(HTML, positions)) == SCANNED
+
+
+def test_placeholders_match_pattern_outside_payloads(tmp_path):
+    html_file = tmp_path / "report.html"
+    html_file.write_text(HTML * 50, encoding="utf-8")
+    text = placeholders_text(read_chunks(html_file, chunk_size=7))
+    assert [match.group(1) for match in PLACEHOLDER_PATTERN.finditer(text)] == (
+        SCANNED * 50
+    )
+
+
+def test_iter_placeholders_parameters():
+    matches = list(iter_placeholders(split(HTML, [20, 70])))
+    assert [match.groups() for match in matches] == [
+        ("x", None),
+        ("z", "loc_admin_1=South Kivu"),
+        ("w", None),
+    ]
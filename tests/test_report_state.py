@@ -0,0 +1,158 @@
+import pandas as pd
+import pytest
+
+from modules.aggregation import combine_counts, subtract_counts
+from modules.linelist_loader import iter_linelist
+from modules.report_generator import aggregate_sections
+from modules.report_state import load_state, save_state, update_state
+
+from conftest import make_linelist
+
+FILTERING_CONFIG = [{"type": "str", "column": "loc_admin_1", "exclude": ["Ituri"]}]
+VARIABLE_NAMES = {"total_cases", "total_deaths", "total_median_age"}
+DIMENSIONS = {"loc_admin_1"}
+
+
+def write_linelist(linelist, file):
+    linelist.to_csv(file, index=False)
+    return file
+
+
+def nonzero_counts(counts):
+    # counts of each key, leaving out zeros
+    if counts is None:
+        return None
+    counts = counts[counts != 0]
+    return counts.sort_index().astype("int64")
+
+
+def assert_aggregates_equal(aggregates, expected):
+    sections_counts, summary = aggregates[:2]
+    expected_counts, expected_summary = expected[:2]
+    assert len(sections_counts) == len(expected_counts)
+    for counts, expected_section_counts in zip(sections_counts, expected_counts):
+        if expected_section_counts is None:
+            assert counts is None
+        else:
+            pd.testing.assert_series_equal(
+                nonzero_counts(counts),
+                nonzero_counts(expected_section_counts),
+                check_names=False,
+                check_index_type=False,
+            )
+    assert summary["total"] == expected_summary["total"]
+    assert summary["counts"].keys() == expected_summary["counts"].keys()
+    for column, counts in expected_summary["counts"].items():
+        pd.testing.assert_series_equal(
+            nonzero_counts(summary["counts"][column]),
+            nonzero_counts(counts),
+            check_names=False,
+            check_index_type=False,
+            check_categorical=False,
+        )
+
+
+def run(state, linelist_file, sections):
+    return update_state(
+        state,
+        iter_linelist(linelist_file, chunksize=64),
+        sections,
+        FILTERING_CONFIG,
+        VARIABLE_NAMES,
+        DIMENSIONS,
+    )
+
+
+def cold_aggregates(linelist_file, sections):
+    return aggregate_sections(
+        iter_linelist(linelist_file, chunksize=64),
+        sections,
+        FILTERING_CONFIG,
+        VARIABLE_NAMES,
+        DIMENSIONS,
+    )
+
+
+def test_new_state_matches_aggregation(linelist_file, sections):
+    aggregates = run(load_state("not_a_file", "key"), linelist_file, sections)
+    assert aggregates[2] == 600
+    assert_aggregates_equal(aggregates, cold_aggregates(linelist_file, sections))
+
+
+def test_warm_run_matches_cold_run(linelist_file, sections, tmp_path):
+    state_file = tmp_path / "state.pkl"
+    state = load_state(state_file, "key")
+    cold = run(state, linelist_file, sections)
+    save_state(state, state_file)
+
+    # nothing changed since the last run
+    state = load_state(state_file, "key")
+    warm = run(state, linelist_file, sections)
+    assert warm[2] == 0
+    assert_aggregates_equal(warm, cold)
+    # a state saved for another key is not reused
+    assert load_state(state_file, "other key")["records"] is None
+
+
+def test_updated_records_match_cold_run(sections, tmp_path):
+    linelist = make_linelist(n=600)
+    state = load_state(tmp_path / "state.pkl", "key")
+    run(state, write_linelist(linelist[:400], tmp_path / "base.csv"), sections)
+
+    # records appended since the last run, records updated (including records
+    # updated twice in the same export) and records already folded in
+    updated = linelist[:60].copy()
+    updated["case_status"] = "died"
+    updated.loc[updated.index[:20], "loc_admin_1"] = "Ituri"
+    updated_twice = updated[:10].assign(sex_at_birth="male")
+    delta = pd.concat(
+        [linelist[350:500], updated, linelist[500:], updated_twice],
+        ignore_index=True,
+    )
+    aggregates = run(state, write_linelist(delta, tmp_path / "delta.csv"), sections)
+    full_linelist = pd.concat([linelist, updated, updated_twice]).drop_duplicates(
+        "record_id", keep="last"
+    )
+    # records appended, and each version of a record (read in a later chunk for records
+    # updated twice) that differs from the version folded in before
+    changed = (updated != linelist[:60]).any(axis=1).sum()
+    changed_twice = (updated_twice != updated[:10]).any(axis=1).sum()
+    assert aggregates[2] == 200 + changed + changed_twice
+
+    full_file = write_linelist(full_linelist, tmp_path / "full.csv")
+    expected = cold_aggregates(full_file, sections)
+    assert_aggregates_equal(aggregates, expected)
+    # the updated state matches a state built from scratch on the full linelist
+    assert_aggregates_equal(
+        run(load_state(tmp_path / "cold.pkl", "key"), full_file, sections), expected
+    )
+
+
+def test_records_without_id_are_rejected(sections):
+    with pytest.raises(ValueError):
+        update_state(
+            load_state("not_a_file", "key"),
+            [make_linelist(n=10).drop(columns="record_id")],
+            sections,
+        )
+
+
+def test_combine_and_subtract_counts_match_pandas():
+    linelist = make_linelist(n=300)
+    keys = ["loc_admin_1", "case_status"]
+    counts = [
+        linelist[start : start + 100].groupby(keys).size() for start in (0, 100, 200)
+    ]
+    combined = None
+    for chunk_counts in counts:
+        combined = combine_counts(combined, chunk_counts)
+    pd.testing.assert_series_equal(combined.sort_index(), linelist.groupby(keys).size())
+
+    # subtracting the counts of a chunk leaves the counts of the other chunks
+    subtracted = subtract_counts(combined, counts[1])
+    expected = pd.concat([linelist[:100], linelist[200:]]).groupby(keys).size()
+    pd.testing.assert_series_equal(subtracted.sort_index(), expected)
+    # keys left with no rows are dropped
+    assert subtract_counts(counts[0], counts[0]).empty
+    assert combine_counts(None, counts[0]) is counts[0]
+    assert subtract_counts(counts[0], None) is counts[0]
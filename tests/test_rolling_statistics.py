@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from modules.rolling_statistics import rolling_statistics
+
+
+@pytest.fixture
+def matrix():
+    # daily counts of three groups, including runs of zeros
+    rng = np.random.default_rng(0)
+    matrix = rng.poisson([2, 5, 20], size=(60, 3)).astype(float)
+    matrix[10:25, 0] = 0
+    matrix[:, 1] *= np.linspace(0.5, 3, 60).round()
+    return matrix
+
+
+def column_statistic(column, window, statistic):
+    # a statistic computed on the counts of a single group, date by date
+    values = []
+    for end in range(1, len(column) + 1):
+        current = column[max(0, end - window) : end]
+        previous = column[max(0, end - 2 * window) : end - window]
+        if statistic == "sum":
+            values.append(current.sum())
+        elif statistic == "mean":
+            values.append(current.mean())
+        else:
+            ratio = (
+                current.sum() / previous.sum()
+                if end >= 2 * window and previous.sum() > 0
+                else np.nan
+            )
+            if statistic == "growth_rate":
+                values.append(ratio - 1)
+            else:
+                values.append(
+                    window * np.log(2) / np.log(ratio) if ratio > 1 else np.nan
+                )
+    return values
+
+
+@pytest.mark.parametrize("statistic", ["sum", "mean", "growth_rate", "doubling_time"])
+@pytest.mark.parametrize("window", [1, 7, 14])
+def test_statistics_match_group_by_group(matrix, statistic, window):
+    values = rolling_statistics(
+        matrix, {"values": {"statistic": statistic, "window": window}}
+    )["values"]
+    assert values.shape == matrix.shape
+    expected = np.column_stack(
+        [column_statistic(column, window, statistic) for column in matrix.T]
+    )
+    np.testing.assert_allclose(values, expected)
+
+
+def test_statistics_match_pandas(matrix):
+    statistics = rolling_statistics(
+        matrix,
+        {
+            "cases_7d": {"statistic": "sum"},
+            "mean_14d": {"statistic": "mean", "window": 14},
+            "ewma": {"statistic": "ewma", "window": 7, "span": 3},
+            "ewma_default_span": {"statistic": "ewma", "window": 5},
+        },
+    )
+    counts = pd.DataFrame(matrix)
+    np.testing.assert_allclose(
+        statistics["cases_7d"], counts.rolling(7, min_periods=1).sum()
+    )
+    np.testing.assert_allclose(
+        statistics["mean_14d"], counts.rolling(14, min_periods=1).mean()
+    )
+    np.testing.assert_allclose(statistics["ewma"], counts.ewm(span=3).mean())
+    np.testing.assert_allclose(
+        statistics["ewma_default_span"], counts.ewm(span=5).mean()
+    )
+
+
+def test_growth_rate_before_two_full_windows_is_nan(matrix):
+    growth_rate = rolling_statistics(
+        matrix, {"growth": {"statistic": "growth_rate", "window": 7}}
+    )["growth"]
+    assert np.isnan(growth_rate[:13]).all()
+    assert np.isfinite(growth_rate[13:, 2]).all()
+
+
+def test_unknown_statistic_raises(matrix):
+    with pytest.raises(ValueError):
+        rolling_statistics(matrix, {"values": {"statistic": "median"}})